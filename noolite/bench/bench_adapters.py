@@ -0,0 +1,90 @@
+"""
+Несколько адаптеров за noolite.Router: адаптеры - эмуляторы на pty
+
+- commands: команды с подтверждением по адресам всех адаптеров, для 1..N адаптеров. Каждый адаптер отправляет
+  кадры не чаще FRAME_GAP, так что пропускная способность должна расти пропорционально числу адаптеров
+- events: события от всех адаптеров приходят в один поток с адресами каналов
+
+Запуск из папки аддона: python -m bench.bench_adapters --adapters 3 --commands 60
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+from bench.bench_pipeline import report
+from bench.emulator import AdapterEmulator
+import noolite as noo
+
+
+async def bench_commands(n: int, commands: int, latency: float):
+    loop = asyncio.get_running_loop()
+    emulators = [AdapterEmulator(latency=latency) for _ in range(n)]
+    for x in emulators:
+        x.start(loop)
+    router = noo.Router([noo.Noolite(x.port, loop) for x in emulators])
+    await router.open()
+    latencies = []
+
+    async def one(addr):
+        t = time.monotonic()
+        ack = await router.send_command(noo.NooliteCommand.make_command(ch=addr, cmd=noo.const.ON, commit=2))
+        assert ack.ch == addr, (ack.ch, addr)
+        latencies.append(time.monotonic() - t)
+
+    # адреса по кругу по адаптерам, внутри адаптера - 16 каналов
+    addrs = [noo.router.address(i % n, i // n % 16) for i in range(commands)]
+    t0 = time.monotonic()
+    await asyncio.gather(*(one(x) for x in addrs))
+    report(f'{n} adapters', commands, time.monotonic() - t0, latencies,
+           per_adapter=[len(x.received) for x in emulators], not_approved=sum(router.not_approved.values()))
+    router.close()
+    await asyncio.sleep(0.01)
+    for x in emulators:
+        x.close()
+
+
+async def bench_events(n: int, events: int):
+    loop = asyncio.get_running_loop()
+    emulators = [AdapterEmulator() for _ in range(n)]
+    for x in emulators:
+        x.start(loop)
+    router = noo.Router([noo.Noolite(x.port, loop) for x in emulators])
+    await router.open()
+    t0 = time.monotonic()
+    for i in range(events):
+        emulators[i % n].inject(emulators[i % n].switch(i // n % 64))
+        if i % 64 == 0:
+            await asyncio.sleep(0)
+    got = []
+    it = router.in_commands
+    while len(got) < events:
+        got.append(await asyncio.wait_for(it.__anext__(), 5))
+    elapsed = time.monotonic() - t0
+    addrs = {x.channel for x in got}
+    assert addrs == {noo.router.address(i % n, i // n % 64) for i in range(events)}, sorted(addrs)
+    report('merged events', events, elapsed, addresses=len(addrs))
+    router.close()
+    await asyncio.sleep(0.01)
+    for x in emulators:
+        x.close()
+
+
+async def bench(args):
+    for n in range(1, args.adapters + 1):
+        await bench_commands(n, args.commands, args.latency)
+    await bench_events(args.adapters, args.events)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--adapters', type=int, default=3)
+    parser.add_argument('--commands', type=int, default=60)
+    parser.add_argument('--events', type=int, default=600)
+    parser.add_argument('--latency', type=float, default=0.02)
+    args = parser.parse_args()
+    asyncio.run(bench(args))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
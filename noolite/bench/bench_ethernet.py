@@ -0,0 +1,117 @@
+"""
+Ethernet-шлюз PR1132 (noolite.NooliteEthernet) против локальной замены bench.pr1132
+
+- commands: команды на разные каналы, по соединению на запрос (как старый _archive/nl_ethernet.py, за одной
+  блокировкой) и через NooliteEthernet с пулом keep-alive соединений
+- sensors: частый опрос sens.xml, показания меняются реже опроса - в буфер событий попадают только изменения
+
+Запуск из папки аддона: python -m bench.bench_ethernet --commands 200 --latency 0.01 --poll 0.05
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+import aiohttp
+
+from bench.bench_pipeline import report
+from bench.pr1132 import PR1132Emulator
+import noolite as noo
+
+
+async def bench_commands(commands: int, latency: float, max_inflight: int):
+    loop = asyncio.get_running_loop()
+    cmds = [noo.NooliteCommand.make_command(ch=i % 16, cmd=noo.const.ON if i % 2 else noo.const.OFF)
+            for i in range(commands)]
+
+    # как было: новый запрос (и соединение) на каждую команду, все за одной блокировкой
+    emulator = PR1132Emulator(latency=latency)
+    url = await emulator.start()
+    lck = asyncio.Lock()
+    latencies = []
+
+    async def one(cmd):
+        t = time.monotonic()
+        async with lck:
+            async with aiohttp.request('get', f'{url}/api.htm', params={'ch': cmd.ch, 'cmd': cmd.cmd}) as resp:
+                await resp.read()
+        latencies.append(time.monotonic() - t)
+
+    t0 = time.monotonic()
+    await asyncio.gather(*(one(x) for x in cmds))
+    report('per-request', commands, time.monotonic() - t0, latencies, connections=len(emulator.connections))
+    await emulator.close()
+
+    emulator = PR1132Emulator(latency=latency)
+    url = await emulator.start()
+    adapter = noo.NooliteEthernet(url, loop, max_inflight=max_inflight, sensor_interval=None)
+    await adapter.open()
+    latencies = []
+
+    async def send(cmd):
+        t = time.monotonic()
+        await adapter.send_command(cmd)
+        latencies.append(time.monotonic() - t)
+
+    t0 = time.monotonic()
+    await asyncio.gather(*(send(x) for x in cmds))
+    elapsed = time.monotonic() - t0
+    # порядок команд внутри канала должен сохраниться
+    for ch in range(16):
+        sent = [str(x.cmd) for x in cmds if x.ch == ch]
+        got = [x['cmd'] for x in emulator.received if x['ch'] == str(ch)]
+        assert sent == got, f'channel {ch}: order broken'
+    report('pooled', commands, elapsed, latencies, connections=len(emulator.connections),
+           not_approved=sum(adapter.not_approved.values()))
+    adapter.close()
+    await asyncio.sleep(0)
+    await emulator.close()
+
+
+async def bench_sensors(duration: float, poll: float, change: float):
+    loop = asyncio.get_running_loop()
+    emulator = PR1132Emulator(latency=0.)
+    emulator.sensors = {0: (21.5, 40, 0), 1: (-3.2, None, 0), 2: (19., 55, 3)}
+    url = await emulator.start()
+    adapter = noo.NooliteEthernet(url, loop, sensor_interval=poll)
+    await adapter.open()
+    t0 = time.monotonic()
+    changes = 0
+    while time.monotonic() - t0 < duration:
+        await asyncio.sleep(change)
+        temp, hum, status = emulator.sensors[0]
+        emulator.sensors[0] = (round(temp + 0.1, 1), hum, status)
+        changes += 1
+    await asyncio.sleep(poll * 2)
+    elapsed = time.monotonic() - t0
+    events = []
+    while not adapter.event_que.empty():
+        events.append(adapter.event_que.get_nowait())
+    assert {x.ch for x in events} == {0, 1, 2}, events
+    assert events[-1].temp == emulator.sensors[0][0], events[-1]
+    report('sensors', adapter.polls, elapsed, events=len(events), changes=changes,
+           failures=adapter.poll_failures, connections=len(emulator.connections))
+    adapter.close()
+    await asyncio.sleep(0)
+    await emulator.close()
+
+
+async def bench(args):
+    await bench_commands(args.commands, args.latency, args.max_inflight)
+    await bench_sensors(args.duration, args.poll, args.change)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--commands', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.01)
+    parser.add_argument('--max-inflight', type=int, default=noo.MAX_INFLIGHT)
+    parser.add_argument('--duration', type=float, default=2.)
+    parser.add_argument('--poll', type=float, default=0.05, help='период опроса sens.xml, сек')
+    parser.add_argument('--change', type=float, default=0.5, help='период изменения показаний, сек')
+    args = parser.parse_args()
+    asyncio.run(bench(args))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,116 @@
+"""
+Микро-бенчмарк сборки кадров: старый dataclass против буферного NooliteCommand и кэша кадров, и разбора сырых
+команд из mqtt: json + MqttCommand против noolite.codec. Перед замерами проверяется, что кадры всех способов
+совпадают, а яркость, прочитанная из ответа SEND_STATE, соответствует отправленной
+
+Запуск из папки аддона: python -m bench.bench_frame
+"""
+from dataclasses import dataclass, astuple, field
+import json
+import timeit
+
+from noolite import NooliteCommand, MqttCommand, StateReading, codec, const, br_to_raw, raw_to_br
+
+DURATION = 12 * 60 * 60
+N = 20000
+RAW = b'{"cmd": 25, "duration": 300, "nrep": 1, "commit": 2}'
+
+
+@dataclass()
+class LegacyNooliteCommand:
+    """
+    Копия прежней реализации NooliteCommand для сравнения
+    """
+    st: int = 171
+    mode: int = 0
+    ctr: int = 0
+    togl: int = field(hash=False, compare=False, default=0)
+    ch: int = 0
+    cmd: int = 0
+    fmt: int = 0
+    d0: int = 0
+    d1: int = 0
+    d2: int = 0
+    d3: int = 0
+    id0: int = 0
+    id1: int = 0
+    id2: int = 0
+    id3: int = 0
+    crc: int = field(hash=False, default=0, compare=False)
+    sp: int = 172
+    commit: bool = 5
+
+    def __post_init__(self):
+        tup = list(astuple(self))
+        self.crc = sum(tup[0:15]) % 256
+
+    def as_tuple(self):
+        return list(astuple(self))[:17]
+
+
+def legacy():
+    cmd = LegacyNooliteCommand(ch=54, cmd=const.TEMPORARY_ON, fmt=2, d0=(DURATION // 5) & 0xFF,
+                               d1=((DURATION // 5) & 0xFF00) >> 8)
+    return bytearray(cmd.as_tuple())
+
+
+def buffered():
+    cmd = NooliteCommand(ch=54, cmd=const.TEMPORARY_ON, fmt=2, d0=(DURATION // 5) & 0xFF,
+                         d1=((DURATION // 5) & 0xFF00) >> 8)
+    return cmd.frame
+
+
+def cached():
+    return NooliteCommand.cached(ch=54, duration=DURATION, cmd=const.TEMPORARY_ON).frame
+
+
+def raw_model():
+    data = json.loads(RAW)
+    data['ch'] = 54
+    return NooliteCommand.make_command(**MqttCommand(**data).dict()).frame
+
+
+def raw_codec():
+    return codec.decode_json(RAW, 54).frame
+
+
+def raw_frame():
+    return codec.decode_frame('ab 00 20 00 36 19 02 90 21 00 00 00 00 00 00 00 ac', 54).frame
+
+
+def check_brightness():
+    """
+    Яркость туда и обратно без эмулятора: кадр SET_BRIGHTNESS (make_command и codec) -> уровень -> SEND_STATE
+    """
+    # br=0 в командах означает "яркость не задана", уровень 0% передается только в ответах
+    for br in range(1, 101):
+        raw = br_to_raw(br)
+        assert NooliteCommand.make_command(ch=1, br=br, cmd=const.SET_BRIGHTNESS).d0 == raw, br
+        assert codec.encode({'ch': 1, 'br': br, 'cmd': const.SET_BRIGHTNESS}).d0 == raw, br
+        state = NooliteCommand(mode=2, ch=1, cmd=const.SEND_STATE, d2=1, d3=raw)
+        back = StateReading.decode(state).brightness
+        # уровней меньше, чем значений яркости: прочитанная яркость дает тот же кадр и отличается не больше шага
+        assert br_to_raw(back) == raw and abs(back - br) <= 1, (br, raw, back)
+        if br % 5 == 0:
+            assert back == br, (br, back)
+    for raw in range(256):
+        br = raw_to_br(raw)
+        assert 0 <= br <= 100
+        if 40 <= raw <= 100:
+            assert br_to_raw(br) == raw, raw
+    assert raw_to_br(br_to_raw(0)) == 0 and br_to_raw(-5) == br_to_raw(0) and br_to_raw(150) == br_to_raw(100)
+    print('brightness: round trip ok')
+
+
+def main():
+    check_brightness()
+    assert bytes(legacy()) == bytes(buffered()) == bytes(cached())
+    assert bytes(raw_model()) == bytes(raw_codec())
+    for name, fn in (('dataclass', legacy), ('buffer', buffered), ('cached', cached), ('raw model', raw_model),
+                     ('raw codec', raw_codec), ('raw frame', raw_frame)):
+        t = min(timeit.repeat(fn, number=N, repeat=5))
+        print(f'{name:>10}: {t / N * 1e6:.2f} us/frame')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Шлюз noolite.gateway на локальном сокете: адаптер - эмулятор на pty, клиенты - Noolite с портом tcp://127.0.0.1
+
+Проверяет, что команды всех клиентов доходят до адаптера и подтверждаются, а входящие события получает каждый
+клиент
+
+Запуск из папки аддона: python -m bench.bench_gateway --clients 3 --commands 30 --events 500
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+from bench.bench_pipeline import report
+from bench.emulator import AdapterEmulator
+import noolite as noo
+
+
+async def bench(clients: int, commands: int, events: int, latency: float):
+    loop = asyncio.get_running_loop()
+    emulator = AdapterEmulator(latency=latency)
+    emulator.start(loop)
+    adapter = noo.Noolite(emulator.port, loop)
+    await adapter.open()
+    gateway = noo.Gateway(adapter)
+    server = await gateway.serve(0, '127.0.0.1')
+    port = server.sockets[0].getsockname()[1]
+    nodes = [noo.Noolite(f'tcp://127.0.0.1:{port}', loop) for _ in range(clients)]
+    await asyncio.gather(*(x.open() for x in nodes))
+    while len(gateway.clients) < clients:
+        await asyncio.sleep(0.001)
+
+    # команды: каждый клиент шлет свою долю на свои каналы
+    latencies = []
+    errors = 0
+
+    async def one(node, ch):
+        nonlocal errors
+        t = time.monotonic()
+        try:
+            await node.send_command(noo.NooliteCommand.make_command(ch=ch, cmd=noo.const.ON, commit=2))
+        except noo.NotApprovedError:
+            errors += 1
+            return
+        latencies.append(time.monotonic() - t)
+
+    t0 = time.monotonic()
+    await asyncio.gather(*(
+        one(nodes[i % clients], (i % clients) * 16 + i // clients % 16) for i in range(commands)
+    ))
+    report('commands', commands, time.monotonic() - t0, latencies, not_approved=errors,
+           adapter_frames=len(emulator.received))
+
+    # события: каждое должен получить каждый клиент
+    async def receive(node):
+        it = node.in_commands
+        for _ in range(events):
+            await it.__anext__()
+
+    receivers = [asyncio.ensure_future(receive(x)) for x in nodes]
+    t0 = time.monotonic()
+    for i in range(0, events, 64):
+        emulator.inject(*(emulator.switch(ch % 64) for ch in range(i, min(events, i + 64))))
+        await asyncio.sleep(0)
+    await asyncio.wait_for(asyncio.gather(*receivers), 30)
+    report('fan-out', events * clients, time.monotonic() - t0, clients=clients)
+
+    for x in nodes:
+        x.close()
+    gateway.close()
+    adapter.close()
+    await asyncio.sleep(0.01)
+    emulator.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=3)
+    parser.add_argument('--commands', type=int, default=30)
+    parser.add_argument('--events', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.02)
+    args = parser.parse_args()
+    asyncio.run(bench(args.clients, args.commands, args.events, args.latency))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
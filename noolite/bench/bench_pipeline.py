@@ -0,0 +1,238 @@
+"""
+Бенчмарк Noolite и main.App.process_msgs без железа: адаптер эмулируется на pty (bench.emulator), брокер - заглушкой
+(bench.broker)
+
+Запуск из папки аддона: python -m bench.bench_pipeline --latency 0.02 --loss 0.01
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+import typing
+
+from bench.broker import FakeClient, make_app
+from bench.emulator import AdapterEmulator
+
+CHANNELS = list(range(32, 64))
+
+
+def percentiles(values: typing.List[float], ps=(50, 90, 99)) -> typing.Dict[int, float]:
+    if not values:
+        return {p: float('nan') for p in ps}
+    values = sorted(values)
+    return {p: values[min(len(values) - 1, len(values) * p // 100)] for p in ps}
+
+
+def report(name: str, n: int, elapsed: float, latencies: typing.List[float] = None, **extra):
+    line = f'{name:>16}: {n / elapsed:10.1f} /s ({n} in {elapsed:.3f} s)'
+    if latencies is not None:
+        line += ' latency ' + ' '.join(f'p{p}={v * 1000:.1f}ms' for p, v in percentiles(latencies).items())
+    for key, value in extra.items():
+        line += f' {key}={value}'
+    print(line)
+
+
+async def bench_commands(noolite, noo, n: int):
+    """
+    Команды в адаптер: пропускная способность и задержка подтверждения
+    """
+    latencies = []
+    errors = 0
+
+    async def one(ch):
+        nonlocal errors
+        t = time.monotonic()
+        try:
+            await noolite.send_command(noo.NooliteCommand.make_command(ch=ch, cmd=noo.const.ON, commit=1))
+        except noo.NotApprovedError:
+            errors += 1
+            return
+        latencies.append(time.monotonic() - t)
+
+    lag = noo.LoopLag(interval=0.005)
+    lag_task = asyncio.ensure_future(lag.run())
+    t0 = time.monotonic()
+    await asyncio.gather(*(one(CHANNELS[i % len(CHANNELS)]) for i in range(n)))
+    report('commands', n, time.monotonic() - t0, latencies, not_approved=errors,
+           loop_lag_max_ms=round(lag.max * 1000, 2))
+    lag_task.cancel()
+
+
+async def bench_events(noolite, emulator: AdapterEmulator, n: int, chunk: int = 64):
+    """
+    Входящие события от пультов: от записи в порт до выхода из noolite.in_commands
+    """
+    events = noolite.in_commands
+    t0 = time.monotonic()
+    done = 0
+    while done < n:
+        size = min(chunk, n - done)
+        emulator.inject(*(emulator.switch(CHANNELS[(done + i) % len(CHANNELS)]) for i in range(size)))
+        for _ in range(size):
+            await events.__anext__()
+        done += size
+    report('inbound events', n, time.monotonic() - t0)
+
+
+async def bench_process_msgs(app, client: FakeClient, n: int):
+    """
+    Сырые команды через App.process_msgs: от сообщения MQTT до ответа в топик noolite/r/<ch>
+    """
+    prefix = f'{app.prefix}/r/'
+    sent = {}
+    latencies = []
+    finished = asyncio.Event()
+
+    def on_publish(msg):
+        if msg.topic.startswith(prefix) or msg.topic.startswith(app.err_prefix):
+            latencies.append(time.monotonic() - sent.pop(msg.topic.rsplit('/', 1)[-1]))
+            if len(latencies) == n:
+                finished.set()
+
+    client.on_publish = on_publish
+    task = asyncio.ensure_future(app.process_msgs(
+        client,
+        parser=app.parse_raw,
+        topic_patt=app.raw_subscription,
+        response_topic=app.raw_response,
+    ))
+    await asyncio.sleep(0.01)
+    t0 = time.monotonic()
+    for i in range(n):
+        ch = CHANNELS[i % len(CHANNELS)]
+        while str(ch) in sent:
+            await asyncio.sleep(0.001)
+        sent[str(ch)] = time.monotonic()
+        client.inject(f'{prefix}{ch}/cmd', json.dumps({'cmd': 2, 'commit': 1}))
+    await finished.wait()
+    report('raw mqtt', n, time.monotonic() - t0, latencies, max_lane=app.dispatcher.max_depth)
+    task.cancel()
+    client.on_publish = None
+
+
+async def bench_slider(app, client: FakeClient, emulator: AdapterEmulator, n: int):
+    """
+    Ползунок яркости: n сообщений set на один канал подряд, время до ответа с последним значением
+    """
+    ch = CHANNELS[0]
+    topic = f'{app.prefix}/s/{ch}'
+    last = json.dumps({'state': 'ON', 'brightness': n})
+    finished = asyncio.Event()
+
+    def on_publish(msg):
+        if msg.topic == topic and msg.payload == last.encode():
+            finished.set()
+
+    client.on_publish = on_publish
+    task = asyncio.ensure_future(app.process_msgs(
+        client,
+        parser=app.parse_msg,
+        topic_patt=app.switch_subscription,
+        response_topic=app.switch_response,
+        coalesce=True,
+    ))
+    await asyncio.sleep(0.01)
+    frames = len(emulator.received)
+    t0 = time.monotonic()
+    for i in range(1, n + 1):
+        client.inject(f'{topic}/set', json.dumps({'state': 'ON', 'brightness': i}))
+    await finished.wait()
+    report('slider', n, time.monotonic() - t0, frames_sent=len(emulator.received) - frames,
+           coalesced=app.dispatcher.coalesced)
+    task.cancel()
+    client.on_publish = None
+
+
+async def bench_scene(app, client: FakeClient, emulator: AdapterEmulator, n: int):
+    """
+    Сцена: n раз включить и выключить все каналы - отдельными сообщениями set и одной группой
+    """
+    group = app.registry.groups['all']
+    lights = asyncio.ensure_future(app.process_msgs(
+        client,
+        parser=app.parse_msg,
+        topic_patt=app.switch_subscription,
+        response_topic=app.switch_response,
+        coalesce=True,
+    ))
+    groups = asyncio.ensure_future(app.process_groups(client))
+    await asyncio.sleep(0.01)
+
+    async def scene(inject, wait_topics):
+        latencies = []
+        for i in range(n):
+            payload = json.dumps({'state': 'ON' if i % 2 else 'OFF'})
+            pending = set(wait_topics)
+            finished = asyncio.Event()
+
+            def on_publish(msg):
+                if msg.payload == payload.encode():
+                    pending.discard(msg.topic)
+                    if not pending:
+                        finished.set()
+
+            client.on_publish = on_publish
+            t = time.monotonic()
+            inject(payload)
+            await finished.wait()
+            latencies.append(time.monotonic() - t)
+        return latencies
+
+    # кэш состояний иначе отбросит повторные команды
+    app.states.ttl = 0
+    t0 = time.monotonic()
+    frames = len(emulator.received)
+    latencies = await scene(
+        lambda payload: [client.inject(f'{app.prefix}/s/{ch}/set', payload) for ch in group.channels],
+        [app.switch_response(ch) for ch in group.channels],
+    )
+    report('scene lights', n, time.monotonic() - t0, latencies, frames_sent=len(emulator.received) - frames)
+    t0 = time.monotonic()
+    frames = len(emulator.received)
+    latencies = await scene(lambda payload: client.inject(group.command_topic, payload), [group.state_topic])
+    report('scene group', n, time.monotonic() - t0, latencies, frames_sent=len(emulator.received) - frames)
+    lights.cancel()
+    groups.cancel()
+    client.on_publish = None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--jitter', type=float, default=0.01)
+    parser.add_argument('--loss', type=float, default=0.)
+    parser.add_argument('--commands', type=int, default=200)
+    parser.add_argument('--events', type=int, default=5000)
+    parser.add_argument('--slider', type=int, default=50)
+    parser.add_argument('--scenes', type=int, default=10)
+    args = parser.parse_args()
+
+    emulator = AdapterEmulator(latency=args.latency, jitter=args.jitter, loss=args.loss, seed=1)
+    try:
+        import noolite as noo
+        client = FakeClient()
+
+        async def run():
+            with make_app(
+                serial_port=emulator.port,
+                lights=[{'ch': ch, 'name': f'light {ch}', 'brightness': True} for ch in CHANNELS],
+                groups=[{'id': 'all', 'name': 'all lights', 'channels': CHANNELS}],
+            ) as app:
+                emulator.start(asyncio.get_running_loop())
+                await app.noolite.open()
+                await bench_commands(app.noolite, noo, args.commands)
+                await bench_events(app.noolite, emulator, args.events)
+                # ответы обработчиков полос идут в App.client, его обычно ставит App.process_mqtt
+                app.client = client
+                await bench_process_msgs(app, client, args.commands)
+                await bench_slider(app, client, emulator, args.slider)
+                await bench_scene(app, client, emulator, args.scenes)
+
+        asyncio.run(run())
+    finally:
+        emulator.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
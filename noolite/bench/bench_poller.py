@@ -0,0 +1,86 @@
+"""
+Опрос состояния устройств nooLite-F (noolite.Poller) на эмуляторе адаптера
+
+- readback: SET_BRIGHTNESS, затем READ_STATE по тому же каналу - прочитанная яркость должна совпасть с заданной.
+  Эмулятор, как устройство, возвращает в SEND_STATE тот уровень, который получил
+- budget: Poller.run на --channels каналах в течение --duration секунд, опросов должно быть не больше бюджета
+
+Запуск из папки аддона: python -m bench.bench_poller --budget 600 --duration 2
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+from bench.bench_pipeline import report
+from bench.emulator import AdapterEmulator
+import noolite as noo
+
+MODE_TX_F = 2
+
+
+async def bench_readback(noolite):
+    poller = noo.Poller(noolite, channels=[])
+    latencies = []
+
+    async def one(ch, levels):
+        for br in levels:
+            await noolite.send_command(
+                noo.NooliteCommand.make_command(mode=MODE_TX_F, ch=ch, br=br, cmd=noo.const.SET_BRIGHTNESS, commit=2)
+            )
+            t = time.monotonic()
+            reading = await poller.poll(ch)
+            latencies.append(time.monotonic() - t)
+            assert reading is not None, ch
+            # уровней в кадре меньше, чем значений яркости: кратные 5 совпадают точно, остальные - до уровня
+            assert noo.br_to_raw(reading.brightness) == noo.br_to_raw(br), (br, reading)
+            if br % 5 == 0:
+                assert reading.brightness == br, (br, reading)
+
+    # каждый третий уровень (все уровни без эмулятора проверяет bench_frame), каналы опрашиваются одновременно, на
+    # каждом - своя часть уровней по порядку
+    levels = range(1, 101, 3)
+    t0 = time.monotonic()
+    await asyncio.gather(*(one(ch, levels[ch::8]) for ch in range(8)))
+    report('readback', len(latencies), time.monotonic() - t0, latencies, failures=poller.failures)
+
+
+async def bench_budget(noolite, channels: int, budget: float, duration: float):
+    poller = noo.Poller(noolite, channels=range(channels), budget=budget, min_interval=0, max_interval=duration)
+    task = asyncio.ensure_future(poller.run())
+    t0 = time.monotonic()
+    await asyncio.sleep(duration)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    elapsed = time.monotonic() - t0
+    limit = int(elapsed * budget / 60) + 1
+    report('budget', poller.polls, elapsed, limit=limit, failures=poller.failures)
+    assert poller.polls <= limit, (poller.polls, limit)
+
+
+async def bench(latency: float, channels: int, budget: float, duration: float):
+    loop = asyncio.get_running_loop()
+    emulator = AdapterEmulator(latency=latency)
+    emulator.start(loop)
+    noolite = noo.Noolite(emulator.port, loop)
+    await noolite.open()
+    try:
+        await bench_readback(noolite)
+        await bench_budget(noolite, channels, budget, duration)
+    finally:
+        noolite.close()
+        emulator.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--latency', type=float, default=0.005)
+    parser.add_argument('--channels', type=int, default=8)
+    parser.add_argument('--budget', type=float, default=600, help='опросов в минуту')
+    parser.add_argument('--duration', type=float, default=2.)
+    args = parser.parse_args()
+    asyncio.run(bench(args.latency, args.channels, args.budget, args.duration))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,107 @@
+"""
+Прореживание показаний датчиков температуры/влажности (noolite.SensorFilter)
+
+- day: синтетические сутки на подставных часах - датчики присылают показания каждые --period секунд, температура
+  медленно меняется по суточному циклу, плюс шум и короткие провалы (проветривание). Сравнивается кол-во показаний
+  и публикаций и насколько опубликованное значение отстает от реального
+- pipeline: кадры датчиков через main.py (декодер, фильтр, публикация) в bench.broker.FakeClient, плюс discovery
+
+Запуск из папки аддона: python -m bench.bench_sensors --sensors 20 --period 10
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import sys
+
+from bench.bench_pipeline import percentiles
+from bench.broker import FakeClient, make_app
+from bench.emulator import AdapterEmulator
+import noolite as noo
+
+DAY = 24 * 60 * 60
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 0.
+
+    def __call__(self):
+        return self.now
+
+
+def true_temp(sensor: int, t: float) -> float:
+    ret = 21 + 2 * math.sin(2 * math.pi * t / DAY + sensor)
+    # проветривание: каждые 6 часов на 15 минут на 3 градуса холоднее
+    if (t + sensor * 600) % (6 * 3600) < 900:
+        ret -= 3
+    return ret
+
+
+def bench_day(sensors: int, period: float, seed: int = 1):
+    rnd = random.Random(seed)
+    clock = Clock()
+    flt = noo.SensorFilter(clock=clock)
+    published = {}
+    errors = []
+    messages = 0
+    for step in range(int(DAY / period)):
+        clock.now = step * period
+        for ch in range(sensors):
+            temp = true_temp(ch, clock.now)
+            reading = noo.TempHumReading(
+                ch, noo.const.SENS_HUM_TEMP, round(temp + rnd.gauss(0, 0.05), 1),
+                int(50 + 10 * math.sin(2 * math.pi * clock.now / DAY) + rnd.gauss(0, 0.5)), 0, 255,
+            )
+            out = flt.accept(reading)
+            if out is not None:
+                published[ch] = out
+                messages += 1
+            errors.append(abs(published[ch].temp - temp))
+    hours = DAY / 3600
+    p = percentiles(errors)
+    print(f'{"day":>16}: {flt.received} readings -> {messages} published '
+          f'({flt.received / sensors / hours:.0f} -> {messages / sensors / hours:.1f} per sensor per hour), '
+          f'lag error p50={p[50]:.2f} p99={p[99]:.2f} max={max(errors):.2f} C')
+
+
+async def bench_pipeline():
+    emulator = AdapterEmulator()
+    with make_app(serial_port=emulator.port, sensors=[
+        {'ch': 5, 'name': 'bedroom', 'humidity': True},
+        {'ch': 6, 'name': 'outside', 'temp_deadband': 0.5, 'min_interval': 0},
+    ]) as app:
+        client = FakeClient()
+        publishing = asyncio.ensure_future(app.process_noolite(client))
+        feed = app.adapters[0].feed
+        # пачка повторов одного и того же: публикуется первое показание каждого датчика
+        for _ in range(50):
+            feed(emulator.sensor(5, 22.3, 41))
+            feed(emulator.sensor(6, -4.1))
+        # изменение больше мертвой зоны у датчика без min_interval публикуется сразу
+        feed(emulator.sensor(6, -5.5))
+        feed(emulator.sensor(6, -5.5))
+        feed(emulator.sensor(6, -5.5))
+        await asyncio.sleep(0.05)
+        publishing.cancel()
+        got = [(msg.topic, json.loads(msg.payload)) for _, msg in client.published]
+        flt = app.noolite.sensor_filter
+        print(f'{"pipeline":>16}: {flt.received} readings -> {len(got)} published: {got}')
+        discovery = {k: json.loads(v) for k, v in app.discovery.items() if '/sensor/' in k}
+        print(f'{"discovery":>16}: ' + ', '.join(f'{v["unique_id"]} ({v["device_class"]})' for v in discovery.values()))
+        emulator.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sensors', type=int, default=20)
+    parser.add_argument('--period', type=float, default=10., help='период показаний датчика, сек')
+    args = parser.parse_args()
+    bench_day(args.sensors, args.period)
+    asyncio.run(bench_pipeline())
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,95 @@
+"""
+Время запуска: импорт main, чтение настроек, открытие порта, подключение к брокеру и первая выполненная команда
+
+Каждый запуск - отдельный процесс python, чтобы импорт был холодным. Эмулятор адаптера работает в этом процессе,
+запускаемый процесс подключается к нему через pty, брокер в нем - заглушка bench.broker.FakeClient
+
+Запуск из папки аддона: python -m bench.bench_startup --runs 5
+
+С --max-first-command бенчмарк годится как проверка: код выхода 1, если медиана времени до первой выполненной
+команды больше порога
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+
+from bench.broker import options_file
+from bench.emulator import AdapterEmulator
+
+CH = 54
+CHILD = '''
+import time
+t0 = time.monotonic()
+import main
+imported = time.monotonic() - t0
+import asyncio, json, sys
+from bench.broker import FakeClient, topic_matches
+
+
+async def run():
+    client = FakeClient()
+    done = asyncio.Event()
+    client.on_publish = lambda msg: done.set() if msg.topic == 'noolite/s/%(ch)d' else None
+    task = asyncio.ensure_future(main.run(sys.argv[1], client_factory=lambda: client))
+    topic = 'noolite/s/%(ch)d/set'
+    while not any(topic_matches(sub, topic) for sub, _ in client._filters):
+        await asyncio.sleep(0.001)
+    client.inject(topic, json.dumps({'state': 'ON'}))
+    await done.wait()
+    first = time.monotonic() - main.STARTED
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    print(json.dumps(dict(main.startup, import_main=imported, first_command=first)))
+
+asyncio.run(run())
+''' % {'ch': CH}
+
+
+async def one(options_path: str) -> dict:
+    proc = await asyncio.create_subprocess_exec(
+        sys.executable, '-c', CHILD, options_path,
+        stdout=asyncio.subprocess.PIPE,
+        env=dict(os.environ, DEVELOP='N'),
+    )
+    out, _ = await proc.communicate()
+    return json.loads(out.decode().strip().splitlines()[-1])
+
+
+async def bench(runs: int, latency: float) -> list:
+    emulator = AdapterEmulator(latency=latency)
+    emulator.start(asyncio.get_running_loop())
+    results = []
+    try:
+        with options_file(serial_port=emulator.port, lights=[{'ch': CH, 'name': 'light'}]) as options_path:
+            for _ in range(runs):
+                results.append(await one(options_path))
+    finally:
+        emulator.close()
+    for stage in ('import_main', 'import', 'config', 'serial', 'mqtt', 'first_command'):
+        values = [x[stage] for x in results if stage in x]
+        if values:
+            print(f'{stage:>14}: median {statistics.median(values) * 1000:8.1f} ms, '
+                  f'max {max(values) * 1000:8.1f} ms')
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--max-first-command', type=float, default=None,
+                        help='порог медианы времени до первой команды, мс')
+    args = parser.parse_args()
+    results = asyncio.run(bench(args.runs, args.latency))
+    if args.max_first_command is not None:
+        first = statistics.median(x['first_command'] for x in results) * 1000
+        if first > args.max_first_command:
+            print(f'first_command {first:.1f} ms > {args.max_first_command:.1f} ms')
+            return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
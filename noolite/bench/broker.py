@@ -0,0 +1,135 @@
+"""
+Заглушка MQTT-клиента с интерфейсом asyncio_mqtt.Client, достаточным для main.py
+
+Опубликованные сообщения складываются в published, входящие сообщения подаются через inject. Там же - временные
+настройки аддона для бенчмарков: options_file и make_app
+"""
+import asyncio
+import json
+import os
+import tempfile
+import time
+import typing
+from contextlib import asynccontextmanager, contextmanager
+
+# настройки аддона, общие для всех бенчмарков, каждый дополняет их своими
+OPTIONS = {
+    'serial_port': '/dev/null',
+    'mqtt_host': 'localhost',
+    'mqtt_user': '',
+    'mqtt_password': '',
+    'mqtt_prefix': 'noolite',
+    'lights': [],
+    'motion': [],
+    'log_level': 'WARNING',
+}
+
+
+@contextmanager
+def options_file(**overrides) -> typing.Iterator[str]:
+    """
+    Пишет options.json во временную папку, она же папка данных аддона (state.json, discovery.json), и удаляет ее
+    на выходе
+    :param overrides: поля, которые заменяют или дополняют OPTIONS
+    :return: путь к options.json
+    """
+    with tempfile.TemporaryDirectory() as data_dir:
+        options_path = os.path.join(data_dir, 'options.json')
+        with open(options_path, 'w') as f:
+            json.dump(dict(OPTIONS, **overrides), f)
+        yield options_path
+
+
+@contextmanager
+def make_app(**overrides):
+    """
+    main.App на временных настройках, папка данных живет, пока открыт контекст. Вызывается из запущенного eventloop
+    :param overrides: поля, которые заменяют или дополняют OPTIONS
+    :return:
+    """
+    import main
+
+    with options_file(**overrides) as options_path:
+        yield main.setup(options_path)
+
+
+def topic_matches(sub: str, topic: str) -> bool:
+    """
+    Проверка соответствия топика подписке с учетом + и #
+    :param sub:
+    :param topic:
+    :return:
+    """
+    sub_parts = sub.split('/')
+    parts = topic.split('/')
+    for i, s in enumerate(sub_parts):
+        if s == '#':
+            return True
+        if i >= len(parts) or (s != '+' and s != parts[i]):
+            return False
+    return len(parts) == len(sub_parts)
+
+
+class Message(typing.NamedTuple):
+    topic: str
+    payload: bytes
+    retain: bool = False
+
+
+class FakeClient:
+
+    def __init__(self, publish_latency: float = 0.):
+        """
+        :param publish_latency: задержка каждого publish, сек
+        """
+        self.publish_latency = publish_latency
+        self.published: typing.List[typing.Tuple[float, Message]] = []
+        self.subscriptions: typing.List[str] = []
+        self._filters: typing.List[typing.Tuple[str, asyncio.Queue]] = []
+        self.on_publish: typing.Optional[typing.Callable[[Message], None]] = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def publish(self, topic: str, payload=None, qos: int = 0, retain: bool = False, **kwargs):
+        if self.publish_latency:
+            await asyncio.sleep(self.publish_latency)
+        if isinstance(payload, str):
+            payload = payload.encode()
+        msg = Message(topic, payload, retain)
+        self.published.append((time.monotonic(), msg))
+        if self.on_publish is not None:
+            self.on_publish(msg)
+
+    async def subscribe(self, topic: str, *args, **kwargs):
+        self.subscriptions.append(topic)
+
+    @asynccontextmanager
+    async def filtered_messages(self, topic_filter: str):
+        que = asyncio.Queue()
+        item = (topic_filter, que)
+        self._filters.append(item)
+
+        async def gen():
+            while True:
+                yield await que.get()
+        try:
+            yield gen()
+        finally:
+            self._filters.remove(item)
+
+    def inject(self, topic: str, payload: typing.Union[str, bytes]):
+        """
+        Эмулирует входящее сообщение от брокера
+        :param topic:
+        :param payload:
+        :return:
+        """
+        if isinstance(payload, str):
+            payload = payload.encode()
+        for sub, que in self._filters:
+            if topic_matches(sub, topic):
+                que.put_nowait(Message(topic, payload))
@@ -0,0 +1,130 @@
+"""
+Эмулятор адаптера MTRF-64 на псевдотерминале (pty)
+
+Noolite подключается к эмулятору как к обычному последовательному порту (см. AdapterEmulator.port). Эмулятор
+принимает 17-байтовые кадры, отвечает подтверждениями с заданной задержкой и потерями, и умеет отправлять входящий
+трафик от пультов, датчиков движения и температуры
+"""
+import asyncio
+import os
+import random
+import time
+import tty
+import typing
+
+from noolite import const
+from noolite.decoder import FrameDecoder
+from noolite.typing import BR_RAW_MAX
+
+FRAME_LEN = 17
+
+
+def make_frame(ch: int, cmd: int, mode: int = 1, fmt: int = 0, d0: int = 0, d1: int = 0, d2: int = 0, d3: int = 0,
+               ctr: int = 0) -> bytes:
+    """
+    Собирает входящий (от адаптера) кадр
+    :return:
+    """
+    frame = bytearray((const.F_IN_BEG, mode, ctr, 0, ch, cmd, fmt, d0, d1, d2, d3, 0, 0, 0, 0, 0, const.F_IN_END))
+    frame[15] = sum(frame[:15]) & 0xFF
+    return bytes(frame)
+
+
+class AdapterEmulator:
+    """
+    Эмулятор адаптера
+    """
+
+    def __init__(
+            self,
+            latency: float = 0.02,
+            jitter: float = 0.,
+            loss: float = 0.,
+            dead_channels: typing.Iterable[int] = (),
+            seed: typing.Optional[int] = None,
+    ):
+        """
+        :param latency: задержка подтверждения, сек
+        :param jitter: случайная добавка к задержке (равномерно от 0 до jitter), сек
+        :param loss: вероятность потери подтверждения
+        :param dead_channels: каналы, на которые подтверждения не приходят никогда
+        :param seed: seed генератора случайных чисел
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.dead_channels = set(dead_channels)
+        self.random = random.Random(seed)
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.decoder = FrameDecoder(beg=const.F_OUT_BEG, end=const.F_OUT_END)
+        self.received: typing.List[typing.Tuple[float, bytes]] = []
+        self.loop: typing.Optional[asyncio.AbstractEventLoop] = None
+        # ch -> (включено, уровень яркости): устройство хранит уровень из d0 SET_BRIGHTNESS и возвращает его в d3
+        # SEND_STATE как есть
+        self.states: typing.Dict[int, typing.Tuple[bool, int]] = {}
+
+    def start(self, loop: typing.Optional[asyncio.AbstractEventLoop] = None):
+        self.loop = loop or asyncio.get_event_loop()
+        self.loop.add_reader(self.master, self._on_data)
+
+    def close(self):
+        if self.loop is not None:
+            self.loop.remove_reader(self.master)
+        os.close(self.master)
+        os.close(self.slave)
+
+    def _on_data(self):
+        for frame in self.decoder.feed(os.read(self.master, 4096)):
+            self.received.append((time.monotonic(), frame))
+            ch = frame[4]
+            if ch in self.dead_channels or self.random.random() < self.loss:
+                continue
+            delay = self.latency + self.random.random() * self.jitter
+            ack = self._apply(frame)
+            self.loop.call_later(delay, self.write, ack)
+
+    def _apply(self, frame: bytes) -> bytes:
+        """
+        Меняет состояние канала по команде и возвращает ответ адаптера
+        :param frame:
+        :return:
+        """
+        ch, cmd = frame[4], frame[5]
+        on, brightness = self.states.get(ch, (False, BR_RAW_MAX))
+        if cmd in (const.ON, const.TEMPORARY_ON):
+            on = True
+        elif cmd == const.OFF:
+            on = False
+        elif cmd == const.SWITCH:
+            on = not on
+        elif cmd == const.SET_BRIGHTNESS:
+            brightness = frame[7]
+        elif cmd == const.READ_STATE:
+            return make_frame(ch=ch, cmd=const.SEND_STATE, mode=frame[1], d2=int(on), d3=brightness)
+        self.states[ch] = (on, brightness)
+        return make_frame(ch=ch, cmd=cmd, mode=frame[1], fmt=frame[6], d0=frame[7], d1=frame[8])
+
+    def write(self, data: bytes):
+        os.write(self.master, data)
+
+    def inject(self, *frames: bytes):
+        """
+        Отправляет в Noolite входящие кадры одним куском
+        :param frames:
+        :return:
+        """
+        self.write(b''.join(frames))
+
+    def motion(self, ch: int, active_time: int = 5) -> bytes:
+        return make_frame(ch=ch, cmd=const.TEMPORARY_ON, fmt=6, d0=active_time // 5)
+
+    def switch(self, ch: int, cmd: int = const.SWITCH) -> bytes:
+        return make_frame(ch=ch, cmd=cmd)
+
+    def sensor(self, ch: int, temp: float, hum: typing.Optional[int] = None, battery: int = 0) -> bytes:
+        raw = round(temp * 10) & 0x0FFF
+        stype = const.SENS_HUM_TEMP if hum is not None else const.SENS_TEMP
+        d1 = (battery << 7) | (stype << 4) | (raw >> 8)
+        return make_frame(ch=ch, cmd=const.SENS_TEMP_HUMI, fmt=7, d0=raw & 0xFF, d1=d1, d2=hum or 0, d3=255)
@@ -0,0 +1,73 @@
+"""
+Локальная замена Ethernet-шлюза PR1132 на aiohttp.web: api.htm запоминает команды, sens.xml отдает показания из
+PR1132Emulator.sensors
+
+Считает TCP-соединения, по которым пришли запросы, чтобы видеть, переиспользует ли клиент соединения
+"""
+import asyncio
+import typing
+
+from aiohttp import web
+
+SENSORS = 4
+
+
+class PR1132Emulator:
+
+    def __init__(self, latency: float = 0.01, chunk: int = 64):
+        """
+        :param latency: время обработки запроса шлюзом, сек
+        :param chunk: sens.xml отдается кусками такого размера, как медленный встроенный веб-сервер
+        """
+        self.latency = latency
+        self.chunk = chunk
+        self.received: typing.List[typing.Dict[str, str]] = []
+        self.sens_requests = 0
+        self.connections = set()
+        # номер датчика -> (температура, влажность или None, состояние snt)
+        self.sensors: typing.Dict[int, typing.Tuple[float, typing.Optional[int], int]] = {}
+        self.runner: typing.Optional[web.AppRunner] = None
+        self.url = None
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        app = web.Application()
+        app.router.add_get('/api.htm', self.api)
+        app.router.add_get('/sens.xml', self.sens)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f'http://{host}:{port}'
+        return self.url
+
+    async def close(self):
+        await self.runner.cleanup()
+
+    async def api(self, request: web.Request):
+        self.connections.add(id(request.transport))
+        await asyncio.sleep(self.latency)
+        self.received.append(dict(request.query))
+        return web.Response(text='OK')
+
+    def xml(self) -> bytes:
+        ret = ['<?xml version="1.0" encoding="windows-1251"?><response>']
+        for n in range(SENSORS):
+            temp, hum, status = self.sensors.get(n, (None, None, 1))
+            ret.append(f'<snst{n}>{"-" if temp is None else temp}</snst{n}>')
+            ret.append(f'<snsh{n}>{"-" if hum is None else hum}</snsh{n}>')
+            ret.append(f'<snt{n}>{status}</snt{n}>')
+        ret.append('</response>')
+        return ''.join(ret).encode()
+
+    async def sens(self, request: web.Request):
+        self.connections.add(id(request.transport))
+        self.sens_requests += 1
+        body = self.xml()
+        resp = web.StreamResponse(headers={'Content-Type': 'text/xml'})
+        resp.content_length = len(body)
+        await resp.prepare(request)
+        for i in range(0, len(body), self.chunk):
+            await resp.write(body[i:i + self.chunk])
+        await resp.write_eof()
+        return resp
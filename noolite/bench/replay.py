@@ -0,0 +1,94 @@
+"""
+Воспроизведение записи трафика адаптера (настройка capture: true, файл /data/capture.bin) через декодер,
+антидребезг, буфер событий и публикацию main.py. Брокер - заглушка bench.broker.FakeClient, порт не открывается
+
+Запуск из папки аддона:
+    python -m bench.replay /path/to/capture.bin --speed 10
+    python -m bench.replay --storm 20000 --speed 0     # синтетический всплеск от датчиков движения
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+from bench.bench_pipeline import report
+from bench.broker import FakeClient, make_app
+from bench.emulator import make_frame
+from noolite import const
+from noolite.capture import read_capture, HEADER, MAGIC, RECORD, DIR_IN
+
+STORM_CHANNELS = list(range(64))
+
+
+def write_storm(path: str, n: int, duration: float, seed: int = 1):
+    """
+    Синтетическая запись: n срабатываний датчиков движения по всем каналам за duration секунд
+    """
+    rnd = random.Random(seed)
+    start = time.monotonic()
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, time.time()))
+        for i in range(n):
+            frame = make_frame(ch=rnd.choice(STORM_CHANNELS), cmd=const.TEMPORARY_ON, fmt=6, d0=1)
+            f.write(RECORD.pack(start + duration * i / n, DIR_IN, frame))
+
+
+async def run(path: str, speed: float, max_gap: float, publish_latency: float):
+    import noolite as noo
+
+    with make_app(motion=[{'ch': ch, 'name': f'motion {ch}'} for ch in STORM_CHANNELS]) as app:
+        client = FakeClient(publish_latency=publish_latency)
+        publishing = asyncio.ensure_future(app.process_noolite(client))
+        t0 = time.monotonic()
+        fed = await noo.replay(app.adapters[0].feed, path, speed=speed, max_gap=max_gap)
+        fed_at = time.monotonic()
+        # ждем, пока буфер событий опустеет
+        while not app.noolite.event_que.empty():
+            await asyncio.sleep(0.001)
+        await asyncio.sleep(0.01)
+        elapsed = time.monotonic() - t0
+        publishing.cancel()
+        report('replay', fed, fed_at - t0)
+        report(
+            'published', len(client.published), elapsed,
+            drain_ms=round((time.monotonic() - fed_at) * 1000, 1),
+            anti_jitter=app.noolite.event_filter.total_suppressed,
+            coalesced=app.publisher.coalesced,
+            batches=app.publisher.batches,
+            dropped=app.noolite.event_que.dropped,
+        )
+        hist = app.publish_latency
+        if hist.count:
+            print(f'{"publish":>16}: mean {hist.sum / hist.count * 1000:.2f} ms over {hist.count}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path', nargs='?', help='файл записи')
+    parser.add_argument('--speed', type=float, default=1., help='0 - без пауз')
+    parser.add_argument('--max-gap', type=float, default=None, help='сокращать паузы длиннее, сек')
+    parser.add_argument('--storm', type=int, default=0, help='сгенерировать запись из N событий')
+    parser.add_argument('--storm-duration', type=float, default=10.)
+    parser.add_argument('--publish-latency', type=float, default=0.)
+    args = parser.parse_args()
+    tmp = None
+    path = args.path
+    if args.storm:
+        with tempfile.NamedTemporaryFile(suffix='.bin', delete=False) as f:
+            tmp = path = f.name
+        write_storm(path, args.storm, args.storm_duration)
+    if path is None:
+        parser.error('path or --storm required')
+    try:
+        print(f'{sum(1 for _ in read_capture(path))} records in {path}')
+        asyncio.run(run(path, args.speed, args.max_gap, args.publish_latency))
+    finally:
+        if tmp:
+            os.unlink(tmp)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,233 +1,657 @@
+from __future__ import annotations
+
+import time
+
+STARTED = time.monotonic()
+
 import asyncio
 from asyncio import FIRST_EXCEPTION
-from asyncio_mqtt import client as ac
-from asyncio_mqtt import Client, Will
 from logger import root_logger
 import noolite as noo
 import json
-import yaml
-from yaml.loader import FullLoader
-from logging import DEBUG
 import os
+import typing
+from functools import lru_cache
 
+if typing.TYPE_CHECKING:
+    from asyncio_mqtt import client as ac
 
-loop = asyncio.get_event_loop()
-with open('/data/options.json') as f:
-    cfg = json.load(f)
-    print(str(cfg))
-
+OPTIONS_PATH = os.environ.get('NOOLITE_OPTIONS', '/data/options.json')
 lg = root_logger.getChild('noolite_mqtt')
-lg.setLevel(cfg['log_level'])
 
 DEFAULT_LIGHT_TIMEOUT = 12 * 60 * 60  # все команды на включение света должны выполняются в форме TEMPORARY_ON с
 # дефолтным временем 12 часов на случай если кто-то забыл выключить свет он гарантировано выключится через 12 часов
-PREFIX = cfg['mqtt_prefix']
-HA_PREFIX = f'homeassistant/{PREFIX}'
-ERR_PREFIX = f'{PREFIX}/err'
-ONLINE_TOPIC = f'{HA_PREFIX}/online'
-OFFLINE = dict(
-    topic=ONLINE_TOPIC,
-    payload='offline',
-)
-MQTT_CONF = {
-    'hostname': cfg['mqtt_host'],
-    'username': cfg['mqtt_user'],
-    'password': cfg['mqtt_password'],
-    'will': Will(**OFFLINE)
-}
-RECONNECT_TIME = 10
-SWITCH_RESPONSE = f'{PREFIX}/s/{{ch}}'
-SWITCH_SUBSCRIPTION = f'{PREFIX}/s/+/set'
-RAW_RESPONSE = f'{PREFIX}/r/{{ch}}'
-RAW_SUBSCRIPTION = f'{PREFIX}/r/+/cmd'
-
-noolite = noo.Noolite(
-    tty_name=cfg['serial_port'],
-    loop=loop
-)
-motions = {}
-
-
-def parse_msg(msg):
-    payload = msg.payload
-    ch = int(msg.topic.split('/')[-2])
-    data = json.loads(payload)
-    lg.debug(data)
-    if 'brightness' in data:
-        yield noo.NooliteCommand.make_command(
-            ch=ch,
-            br=int(data['brightness']),
-            cmd=noo.const.SET_BRIGHTNESS,
-        )
-        if data['state'] == 'ON':
-            yield noo.NooliteCommand.make_command(
-                ch=ch,
-                duration=DEFAULT_LIGHT_TIMEOUT if data['state'] == 'ON' else None,
-                cmd=noo.const.TEMPORARY_ON,
-            )
-    else:
-        yield noo.NooliteCommand.make_command(
-            ch=ch,
-            duration=DEFAULT_LIGHT_TIMEOUT if data['state'] == 'ON' else None,
-            cmd=noo.const.TEMPORARY_ON if data['state'] == 'ON' else noo.const.OFF,
-        )
+RECONNECT_TIME_MIN = 1
+RECONNECT_TIME_MAX = 60
+HA_STATUS_TOPIC = 'homeassistant/status'
+CAPTURE_FILE = 'capture.bin'  # запись трафика адаптера, если в настройках capture: true
+CAPTURE_MAX_MB = 50  # размер файла записи, после которого начинается новый, старый остается в capture.bin.1
+# длительность этапов запуска от старта процесса, сек
+startup: typing.Dict[str, float] = {}
 
 
-def parse_raw(msg):
-    payload = msg.payload
-    ch = int(msg.topic.split('/')[-2])
+@lru_cache(maxsize=1024)
+def light_commands(ch: int, state: str, brightness=None):
+    """
+    Готовые кадры для перевода светильника в состояние
+    :return: кортеж команд
+    """
+    if brightness is not None:
+        ret = (noo.NooliteCommand.cached(ch=ch, br=brightness, cmd=noo.const.SET_BRIGHTNESS), )
+        if state == 'ON':
+            ret += (noo.NooliteCommand.cached(ch=ch, duration=DEFAULT_LIGHT_TIMEOUT, cmd=noo.const.TEMPORARY_ON), )
+        return ret
+    if state == 'ON':
+        return noo.NooliteCommand.cached(ch=ch, duration=DEFAULT_LIGHT_TIMEOUT, cmd=noo.const.TEMPORARY_ON),
+    return noo.NooliteCommand.cached(ch=ch, duration=None, cmd=noo.const.OFF),
+
+
+@lru_cache(maxsize=256)
+def parse_state(payload: bytes):
+    """
+    Разбор json-состояния Home Assistant, одинаковые payload (сцены шлют одно и то же) разбираются один раз
+    :return: (state, brightness)
+    """
     data = json.loads(payload)
-    data['ch'] = ch
-    cmd = noo.MqttCommand(**data)
-    yield noo.NooliteCommand.make_command(**cmd.dict())
-
-
-def get_lights():
-    devices = cfg['lights']
-    for value in devices:
-        ch = value.pop('ch')
-        if value.get('brightness'):
-            value['brightness_scale'] = 100
-        state_topic = f'{PREFIX}/s/{ch}'
-        command_topic = f'{state_topic}/set'
-        id = f'{PREFIX}_s_{ch}'
-        yield id, dict(
-            **value,
-            unique_id=id,
-            availability_topic=ONLINE_TOPIC,
-            command_topic=command_topic,
-            state_topic=state_topic,
-            schema='json',
-        )
+    return data['state'], int(data['brightness']) if 'brightness' in data else None
 
 
-def get_motions():
-    devices = cfg['motion']
-    for value in devices:
-        ch = value.pop('ch')
-        state_topic = f'{PREFIX}/m/{ch}'
-        id = f'{PREFIX}_m_{ch}'
-        if 'off_delay' not in value:
-            value['off_delay'] = 1
-        if 'long' in value:
-            value.pop('long')
-            lid = f'{id}_l'
-            _val = value.copy()
-            if 'name' in _val:
-                _val['name'] = _val['name'] + ' L'
-            yield lid, dict(
-                **_val,
-                unique_id=lid,
-                availability_topic=ONLINE_TOPIC,
-                state_topic=f'{state_topic}_l',
-            )
-        yield id, dict(
-            **value,
-            unique_id=id,
-            availability_topic=ONLINE_TOPIC,
-            state_topic=state_topic,
+class App:
+    """
+    Настройки и все объекты моста nooLite - MQTT
+    """
+
+    def __init__(self, options_path: str = OPTIONS_PATH):
+        """
+        Читает настройки и создает все объекты, ничего не подключая. Вызывается из запущенного eventloop
+        :param options_path:
+        """
+        self.loop = asyncio.get_running_loop()
+        self.data_dir = os.path.dirname(options_path)
+        with open(options_path) as f:
+            self.cfg = cfg = json.load(f)
+            print(str(cfg))
+        lg.setLevel(cfg['log_level'])
+
+        self.prefix = cfg['mqtt_prefix']
+        self.ha_prefix = f'homeassistant/{self.prefix}'
+        self.err_prefix = f'{self.prefix}/err'
+        self.online_topic = f'{self.ha_prefix}/online'
+        self.offline = dict(
+            topic=self.online_topic,
+            payload='offline',
         )
+        self.mqtt_conf = {
+            'hostname': cfg['mqtt_host'],
+            'username': cfg['mqtt_user'],
+            'password': cfg['mqtt_password'],
+        }
+        self.switch_subscription = f'{self.prefix}/s/+/set'
+        self.diag_topic = f'{self.prefix}/diag'
+        self.diag_interval = cfg.get('diag_interval', 60)
+        # метрики prometheus, на всех интерфейсах - только если metrics_host задан явно
+        self.metrics_port = cfg.get('metrics_port')
+        self.metrics_host = cfg.get('metrics_host', noo.metrics.DEFAULT_HOST)
+        # адаптер доступен другим экземплярам по tcp://<host>:<gateway_port>, на всех интерфейсах - только если
+        # gateway_host задан явно, привязка и отвязка от клиентов - только с gateway_service
+        self.gateway_port = cfg.get('gateway_port')
+        self.gateway_host = cfg.get('gateway_host', noo.gateway.DEFAULT_HOST)
+        self.gateway_service = cfg.get('gateway_service', False)
+        self.raw_subscription = f'{self.prefix}/r/+/cmd'
+        self.frame_subscription = f'{self.prefix}/b/+/cmd'
+        self.group_subscription = f'{self.prefix}/g/+/set'
 
+        self.registry = noo.Registry(cfg, prefix=self.prefix, availability_topic=self.online_topic)
+        self.states = noo.StateCache(os.path.join(self.data_dir, 'state.json'), ttl=cfg.get('state_ttl', 60))
+        self.light_topics = {x.state_topic for x in self.registry.lights.values()}
+        self.sensor_topics = {x.state_topic for x in self.registry.sensors.values()}
 
-async def announce(client: ac.Client):
-    for id, cfg in get_lights():
-        lg.debug('announce: %s', cfg)
-        await client.publish(
-            topic=f'homeassistant/light/{id}/config',
-            payload=json.dumps(cfg),
+        # фильтр датчиков, как и антидребезг в Router, общий для всех адаптеров, ключ - адрес канала
+        shared = dict(
+            loop=self.loop,
+            max_inflight=cfg.get('max_inflight', noo.MAX_INFLIGHT),
+            event_buffer_size=cfg.get('event_buffer_size', noo.EVENT_BUFFER_SIZE),
+            event_drop_policy=cfg.get('event_drop_policy', noo.DROP_OLDEST),
+            sensor_filter=self.get_sensor_filter(),
         )
-    for id, cfg in get_motions():
-        lg.debug('announce: %s', cfg)
-        await client.publish(
-            topic=f'homeassistant/binary_sensor/{id}/config',
-            payload=json.dumps(cfg),
+        # адаптер 0 - serial_port, следующие - из adapters, номер адаптера указывается у устройств в adapter
+        self.adapters = [
+            self.make_adapter(n, port, **shared)
+            for n, port in enumerate([cfg['serial_port'], *cfg.get('adapters', ())])
+        ]
+        # порты открываются позже, в noolite.open(), команды и события всех адаптеров идут через один Router
+        self.noolite = noo.Router(self.adapters, event_filter=self.get_event_filter())
+        noo.warm_cache(
+            set(self.registry.lights).union(*(x.channels for x in self.registry.groups.values())),
+            DEFAULT_LIGHT_TIMEOUT,
+            # у диммеров чаще всего просят полную яркость или ту, что была до выключения
+            levels={ch: {100, getattr(self.states.get(ch), 'brightness', None) or 100}
+                    for ch, light in self.registry.lights.items() if light.brightness},
         )
+        self.publish_latency = noo.Histogram()
+        # опрос состояния устройств nooLite-F, у которых в настройках poll: true, PR1132 их не поддерживает. У каждого
+        # адаптера свой опрос со своим бюджетом, кадры опроса идут мимо Router, с каналами адаптера
+        self.pollers = [
+            noo.Poller(
+                adapter,
+                channels=[
+                    x.ch % noo.CHANNELS for x in self.registry.lights.values() if x.poll and x.ch // noo.CHANNELS == n
+                ],
+                budget=cfg.get('poll_budget', 6),
+                min_interval=cfg.get('poll_min_interval', 30),
+                max_interval=cfg.get('poll_max_interval', 600),
+            )
+            for n, adapter in enumerate(self.adapters) if isinstance(adapter, noo.Noolite)
+        ]
+        self.publisher = noo.BatchPublisher(
+            max_inflight=cfg.get('publish_inflight', 8),
+            coalesce_window=cfg.get('publish_coalesce_window', 0.5),
+        )
+        # собираем один раз при старте, при переподключении используются готовые payload
+        self.discovery = self.registry.discovery()
+        self.manifest = noo.DiscoveryManifest(os.path.join(self.data_dir, 'discovery.json'))
+        # общий для всех топиков, так что сырые команды и команды set по одному каналу выполняются по порядку
+        self.dispatcher = noo.Dispatcher(self.execute, lane_size=cfg.get('lane_size', noo.LANE_SIZE))
+        # у групп свои полосы: пока группа ждет подтверждений, команды отдельным каналам не блокируются
+        self.group_dispatcher = noo.Dispatcher(self.execute_group, lane_size=cfg.get('lane_size', noo.LANE_SIZE))
+        self.loop_lag = noo.LoopLag()
+        self.metrics = self.get_metrics()
+        # текущее соединение с брокером, None - нет соединения. Обработчики полос берут его в момент ответа: пока
+        # команда ждет в полосе или подтверждения, клиент может переподключиться
+        self.client: typing.Optional[ac.Client] = None
 
-
-async def process_noolite(client: ac.Client):
-    async for cmd in noolite.in_commands:
-        if cmd.cmd in (noo.const.ON, noo.const.SWITCH, noo.const.TEMPORARY_ON):
-            await client.publish(
-                topic=f'{PREFIX}/m/{cmd.ch}',
-                payload='ON',
+    def make_adapter(self, n: int, port: str, **kwargs):
+        """
+        Адаптер по имени порта: http://... - Ethernet-шлюз PR1132, иначе MTRF-64 на порту или tcp://host:port
+        :param n: номер адаптера
+        :param port:
+        :param kwargs: общие для всех адаптеров параметры
+        :return:
+        """
+        if port.startswith(('http://', 'https://')):
+            return noo.NooliteEthernet(
+                port, sensor_interval=self.cfg.get('sensor_interval', noo.SENSOR_INTERVAL), **kwargs
             )
+        capture = None
+        if self.cfg.get('capture'):
+            name, ext = os.path.splitext(CAPTURE_FILE)
+            capture = noo.CaptureWriter(
+                os.path.join(self.data_dir, f'{name}_{n}{ext}' if n else CAPTURE_FILE),
+                max_size=self.cfg.get('capture_max_mb', CAPTURE_MAX_MB) * 1024 * 1024,
+            )
+        return noo.Noolite(tty_name=port, capture=capture, **kwargs)
 
-        elif cmd.cmd == noo.const.OFF:
-            await client.publish(
-                topic=f'{PREFIX}/m/{cmd.ch}',
-                payload='OFF',
+    def switch_response(self, ch):
+        return self.registry.topic('s', ch)
+
+    def raw_response(self, ch):
+        return self.registry.topic('r', ch)
+
+    def frame_response(self, ch):
+        return self.registry.topic('b', ch)
+
+    def get_sensor_filter(self):
+        """
+        Прореживание показаний датчиков температуры/влажности по их настройкам, датчики без настроек - по умолчанию
+        """
+        ret = noo.SensorFilter()
+        for sensor in self.registry.sensors.values():
+            if sensor.filter:
+                ret.configure(sensor.ch, ret.default._replace(**sensor.filter))
+        return ret
+
+    def get_event_filter(self):
+        """
+        Антидребезг по настройкам датчиков: debounce - окно для TEMPORARY_ON, long_debounce - для долгих нажатий
+        (BRIGHT_BACK), в секундах
+        """
+        ret = noo.EventFilter()
+        for motion in self.registry.motions.values():
+            if motion.debounce is not None:
+                ret.set_window(motion.ch, noo.const.TEMPORARY_ON, motion.debounce)
+            if motion.long_debounce is not None:
+                ret.set_window(motion.ch, noo.const.BRIGHT_BACK, motion.long_debounce)
+        return ret
+
+    def parse_msg(self, msg):
+        ch = self.registry.channel(msg.topic)
+        state, brightness = parse_state(msg.payload)
+        lg.debug('%s: %s %s', ch, state, brightness)
+        if self.states.is_current(ch, state, brightness):
+            # свет уже в нужном состоянии, в радиоэфир ничего не отправляем
+            self.states.skipped += 1
+            lg.debug('skip %s: already %s', ch, state)
+            return
+        yield from light_commands(ch, state, brightness)
+        # сюда доходим только если все команды отправлены и подтверждены
+        self.states.update(ch, state, brightness)
+
+    def parse_raw(self, msg):
+        ch = self.registry.channel(msg.topic)
+        cmd = noo.codec.decode_json(msg.payload, ch)
+        # результат сырой команды заранее не известен
+        self.states.invalidate(ch)
+        yield cmd
+
+    def parse_frame(self, msg):
+        """
+        Готовый кадр (17 чисел или hex), канал берется из топика
+        """
+        ch = self.registry.channel(msg.topic)
+        cmd = noo.codec.decode_frame(msg.payload, ch)
+        self.states.invalidate(ch)
+        yield cmd
+
+    async def announce(self, client: ac.Client, force: bool = False):
+        """
+        Публикует (с retain) только те конфиги discovery, которые изменились с прошлой публикации
+        :param client:
+        :param force: публикует все конфиги
+        :return:
+        """
+        changed = self.manifest.diff(self.discovery, force=force)
+        lg.debug('announce: %s', list(changed))
+        topics = list(changed)
+        results = await asyncio.gather(*(
+            client.publish(topic=topic, payload=changed[topic], retain=True)
+            for topic in topics
+        ), return_exceptions=True)
+        errors = [x for x in results if isinstance(x, Exception)]
+        self.manifest.update({
+            topic: changed[topic] for topic, res in zip(topics, results) if not isinstance(res, Exception)
+        })
+        if errors:
+            raise errors[0]
+
+    async def publish(self, client: ac.Client, **kwargs):
+        """
+        client.publish с замером времени
+        """
+        t = self.loop.time()
+        await client.publish(**kwargs)
+        self.publish_latency.observe(self.loop.time() - t)
+
+    def event_message(self, cmd):
+        """
+        Топик и состояние для входящего события, None - событие не публикуется
+        """
+        if isinstance(cmd, noo.DeviceState):
+            # ответ устройства на READ_STATE
+            self.states.update(cmd.ch, 'ON' if cmd.on else 'OFF', cmd.brightness)
+            return self.registry.topic('s', cmd.ch), self.states.get(cmd.ch).payload()
+        elif isinstance(cmd, noo.TempHumReading):
+            # уже прореженные и усредненные SensorFilter показания
+            return self.registry.topic('t', cmd.ch), json.dumps(
+                {'temp': cmd.temp, 'hum': cmd.hum, 'battery': cmd.battery}
             )
+        elif cmd.cmd in (noo.const.ON, noo.const.SWITCH, noo.const.TEMPORARY_ON):
+            return self.registry.topic('m', cmd.ch), 'ON'
+        elif cmd.cmd == noo.const.OFF:
+            return self.registry.topic('m', cmd.ch), 'OFF'
         elif cmd.cmd == noo.const.BRIGHT_BACK:
             # долгие нажатия
+            return self.registry.topic('m_l', cmd.ch), 'ON'
+
+    async def process_noolite(self, client: ac.Client):
+        async def send(topic, payload):
+            await self.publish(
+                client, topic=topic, payload=payload, retain=topic in self.light_topics or topic in self.sensor_topics
+            )
+
+        # неопубликованные из-за потери соединения события возвращаются в буфер и будут опубликованы после
+        # переподключения
+        await self.publisher.run(self.noolite.event_que, send, self.event_message)
+
+    async def respond(self, **kwargs):
+        """
+        Публикует ответ через текущее соединение с брокером. Без соединения ответ теряется: состояния светильников
+        публикуются из кэша после переподключения
+        """
+        client = self.client
+        if client is None:
+            lg.warning('not connected, %s not published', kwargs['topic'])
+            return
+        await self.publish(client, **kwargs)
+
+    async def publish_states(self, client: ac.Client):
+        """
+        Публикует состояния светильников из кэша
+        """
+        await asyncio.gather(*(
+            client.publish(topic=light.state_topic, payload=self.states.get(ch).payload(), retain=True)
+            for ch, light in self.registry.lights.items()
+            if self.states.get(ch) is not None
+        ))
+
+    async def process_ha_status(self, client: ac.Client):
+        """
+        После перезапуска Home Assistant заново публикует все конфиги discovery (брокер мог перезапуститься вместе с
+        ним и потерять retain-сообщения, а манифест об этом не знает) и отдает состояния из кэша, не опрашивая
+        устройства
+        """
+        await client.subscribe(HA_STATUS_TOPIC)
+        async with client.filtered_messages(HA_STATUS_TOPIC) as messages:
+            async for msg in messages:
+                if msg.payload == b'online':
+                    lg.debug('home assistant online, announce and publish states')
+                    await self.announce(client, force=True)
+                    await self.publish_states(client)
+
+    async def send_group(self, group: noo.Group, state: str, brightness=None):
+        """
+        Отправляет состояние всем каналам группы одновременно: кадры разных каналов идут в адаптер конвейером, общее
+        время - примерно одно ожидание подтверждения, а не по одному на канал
+        :return: (подтвердившие каналы, каналы с ошибкой)
+        """
+        async def send_channel(ch):
+            if self.states.is_current(ch, state, brightness):
+                self.states.skipped += 1
+                return
+            for cmd in light_commands(ch, state, brightness):
+                await self.noolite.send_command(cmd)
+            self.states.update(ch, state, brightness)
+
+        results = await asyncio.gather(*(send_channel(ch) for ch in group.channels), return_exceptions=True)
+        ok, failed = [], {}
+        for ch, res in zip(group.channels, results):
+            if isinstance(res, Exception):
+                failed[ch] = str(res)
+            else:
+                ok.append(ch)
+        return ok, failed
+
+    async def execute_group(self, group_id: str, msg):
+        """
+        Обработчик полосы группы: одна команда Home Assistant - по кадру на каждый канал группы
+        :param group_id:
+        :param msg: сообщение mqtt
+        :return:
+        """
+        group = self.registry.groups[group_id]
+        try:
+            state, brightness = parse_state(msg.payload)
+            ok, failed = await self.send_group(group, state, brightness)
+            # состояния отдельных светильников группы тоже меняются
+            await asyncio.gather(*(
+                self.respond(topic=self.registry.lights[ch].state_topic, payload=self.states.get(ch).payload(),
+                             retain=True)
+                for ch in ok if ch in self.registry.lights
+            ))
+            if failed:
+                lg.warning('group %s failed on %s', group_id, list(failed))
+                await self.respond(
+                    topic=f'{self.err_prefix}/g/{group_id}',
+                    payload=json.dumps({'ok': ok, 'failed': failed}),
+                )
+            else:
+                await self.respond(topic=group.state_topic, payload=msg.payload, retain=True)
+        except Exception as exc:
+            await self.respond(
+                topic=f'{self.err_prefix}/g/{group_id}',
+                payload=str(exc)
+            )
+            lg.exception('sending to group %s', group_id)
+
+    async def execute(self, ch: int, item):
+        """
+        Обработчик полосы канала: отправляет команды в адаптер и сообщает о результате
+        :param ch:
+        :param item: (parser, response_topic, msg)
+        :return:
+        """
+        parser, response_topic, msg = item
+        try:
+            for cmd in parser(msg):
+                await self.noolite.send_command(cmd)
+            # сообщаем что все ок
+            await self.respond(
+                topic=response_topic(ch),
+                payload=msg.payload,
+                retain=True,
+            )
+        except Exception as exc:
+            await self.respond(
+                topic=f'{self.err_prefix}/{ch}',
+                payload=str(exc)
+            )
+            lg.exception('sending to %s', ch)
+
+    def get_metrics(self):
+        ret = noo.Metrics()
+        adapters, noolite, dispatcher, states = self.adapters, self.noolite, self.dispatcher, self.states
+        mtrf = [x for x in adapters if isinstance(x, noo.Noolite)]
+        ethernet = [x for x in adapters if isinstance(x, noo.NooliteEthernet)]
+        if mtrf:
+            ret.counter('noolite_frames_in_total', 'Принятые от адаптера кадры',
+                        lambda: sum(x.decoder.frames for x in mtrf))
+            ret.counter('noolite_frames_bad_total', 'Отброшенные битые кадры',
+                        lambda: sum(x.decoder.bad_frames for x in mtrf))
+            ret.counter('noolite_bytes_dropped_total', 'Отброшенные при синхронизации байты',
+                        lambda: sum(x.decoder.dropped_bytes for x in mtrf))
+        if ethernet:
+            ret.counter('noolite_sensor_polls_total', 'Опросы датчиков PR1132',
+                        lambda: sum(x.polls for x in ethernet))
+            ret.counter('noolite_sensor_poll_failures_total', 'Неудачные опросы датчиков PR1132',
+                        lambda: sum(x.poll_failures for x in ethernet))
+        sensor_filter = noolite.sensor_filter
+        ret.counter('noolite_sensor_readings_total', 'Принятые показания датчиков температуры/влажности',
+                    lambda: sensor_filter.received)
+        ret.counter('noolite_sensor_published_total', 'Показания датчиков, прошедшие фильтр',
+                    lambda: sensor_filter.published)
+        ret.counter('noolite_adapter_frames_out_total', 'Отправленные кадры по адаптерам',
+                    lambda: dict(enumerate(x.frames_out for x in adapters)), label='adapter')
+        ret.counter('noolite_frames_out_total', 'Отправленные в адаптер кадры', lambda: noolite.frames_out)
+        ret.histogram('noolite_ack_latency_seconds', 'Время до подтверждения команды', noolite.ack_latency)
+        ret.counter('noolite_not_approved_total', 'Неподтвержденные команды', lambda: noolite.not_approved,
+                    label='ch')
+        ret.counter('noolite_anti_jitter_total', 'Отброшенные антидребезгом события',
+                    lambda: noolite.event_filter.suppressed, label=('ch', 'cmd'))
+        ret.gauge('noolite_event_buffer', 'События, ожидающие публикации', noolite.event_que.qsize)
+        ret.counter('noolite_event_buffer_dropped_total', 'События, отброшенные при переполнении буфера',
+                    lambda: noolite.event_que.dropped)
+        ret.gauge('noolite_lane_depth', 'Длина полосы канала', dispatcher.depths, label='ch')
+        ret.counter('noolite_coalesced_total', 'Замененные более свежими команды', lambda: dispatcher.coalesced)
+        ret.counter('noolite_lane_waits_total', 'Ожидания освобождения полосы', lambda: dispatcher.waits)
+        ret.histogram('noolite_mqtt_publish_seconds', 'Время публикации в mqtt', self.publish_latency)
+        ret.counter('noolite_state_skipped_total', 'Неотправленные команды: свет уже в нужном состоянии',
+                    lambda: states.skipped)
+        ret.gauge('noolite_send_queued', 'Команды, ожидающие слота отправки', noolite.queued, label='priority')
+        ret.counter('noolite_polls_total', 'Опросы состояния устройств', lambda: sum(x.polls for x in self.pollers))
+        ret.counter('noolite_poll_failures_total', 'Опросы без ответа',
+                    lambda: sum(x.failures for x in self.pollers))
+        ret.counter('noolite_publish_batches_total', 'Пачки опубликованных событий', lambda: self.publisher.batches)
+        ret.counter('noolite_publish_coalesced_total', 'Неопубликованные повторы состояний',
+                    lambda: self.publisher.coalesced)
+        ret.histogram('noolite_loop_lag_seconds', 'Задержка eventloop', self.loop_lag.hist)
+        ret.gauge('noolite_loop_lag_max_seconds', 'Максимальная задержка eventloop', lambda: self.loop_lag.max)
+        ret.gauge('noolite_write_buffer_bytes', 'Неотправленные в порт байты',
+                  lambda: sum(x.transport.get_write_buffer_size() for x in adapters if x.transport is not None))
+        ret.gauge('noolite_startup_seconds', 'Время от старта процесса до завершения этапа запуска', lambda: startup,
+                  label='stage')
+        return ret
+
+    async def process_diag(self, client: ac.Client):
+        """
+        Периодически публикует метрики в топик диагностики
+        """
+        while True:
+            await asyncio.sleep(self.diag_interval)
             await client.publish(
-                topic=f'{PREFIX}/m/{cmd.ch}_l',
-                payload='ON',
+                topic=self.diag_topic,
+                payload=json.dumps(self.metrics.snapshot()),
             )
 
-async def process_msgs(
-        client: ac.Client,
-        parser,
-        topic_patt,
-        response_template: str
-    ):
+    async def process_msgs(
+            self,
+            client: ac.Client,
+            parser,
+            topic_patt,
+            response_topic,
+            coalesce: bool = False,
+        ):
+        """
+        :param response_topic: функция, возвращающая топик ответа по номеру канала
+        :param coalesce: если истина, по каждому каналу отправляется только последнее из накопившихся за время
+            отправки состояний, промежуточные отбрасываются (например, когда двигают ползунок яркости)
+        :return:
+        """
+        await client.subscribe(topic_patt)
+        async with client.filtered_messages(topic_patt) as messages:
+            lg.debug('subscribe to %s', topic_patt)
+            async for msg in messages:
+                lg.debug('process %s: %s', msg.topic, msg.payload)
+                try:
+                    ch = self.registry.channel(msg.topic)
+                except ValueError as exc:
+                    lg.warning('skip %s: %s', msg.topic, exc)
+                    continue
+                # если полоса канала заполнена, ждем - новые сообщения от брокера не читаются
+                await self.dispatcher.put(ch, (parser, response_topic, msg), coalesce=coalesce)
+
+    async def process_groups(self, client: ac.Client):
+        await client.subscribe(self.group_subscription)
+        async with client.filtered_messages(self.group_subscription) as messages:
+            lg.debug('subscribe to %s', self.group_subscription)
+            async for msg in messages:
+                group = self.registry.group_by_topic.get(msg.topic)
+                if group is None:
+                    lg.warning('unknown group %s', msg.topic)
+                    continue
+                # промежуточные состояния группы не нужны, выполняется последнее
+                await self.group_dispatcher.put(group.id, msg, coalesce=True)
+
+    def mqtt_client(self):
+        """
+        Клиент mqtt, asyncio_mqtt импортируется только здесь - пока он грузится, порт уже открывается
+        """
+        from asyncio_mqtt import Client, Will
+        return Client(**self.mqtt_conf, will=Will(**self.offline))
+
+    async def process_mqtt(self, client_factory):
+        """
+        Подключение к брокеру с переподключением
+        :param client_factory: создает клиента mqtt
+        :return:
+        """
+        backoff = noo.Backoff(RECONNECT_TIME_MIN, RECONNECT_TIME_MAX)
+        while True:
+            try:
+                async with client_factory() as client:
+                    self.client = client
+                    try:
+                        await self.announce(client)
+                        await client.publish(
+                            topic=self.online_topic,
+                            payload='online',
+                        )
+                        await self.publish_states(client)
+                        backoff.reset()
+                        tasks = [asyncio.ensure_future(x) for x in (
+                            self.process_msgs(
+                                client,
+                                topic_patt=self.switch_subscription,
+                                response_topic=self.switch_response,
+                                parser=self.parse_msg,
+                                coalesce=True,
+                            ),
+                            self.process_msgs(
+                                client,
+                                topic_patt=self.raw_subscription,
+                                response_topic=self.raw_response,
+                                parser=self.parse_raw
+                            ),
+                            self.process_msgs(
+                                client,
+                                topic_patt=self.frame_subscription,
+                                response_topic=self.frame_response,
+                                parser=self.parse_frame
+                            ),
+                            self.process_groups(client),
+                            self.process_noolite(client),
+                            self.process_diag(client),
+                            self.process_ha_status(client),
+                        )]
+                        startup.setdefault('mqtt', time.monotonic() - STARTED)
+                        try:
+                            done, pending = await asyncio.wait(tasks, return_when=FIRST_EXCEPTION)
+                            for x in done:
+                                await x
+                        finally:
+                            for x in tasks:
+                                x.cancel()
+                            await asyncio.gather(*tasks, return_exceptions=True)
+                    finally:
+                        self.client = None
+                        await client.publish(**self.offline)
+            except Exception:
+                lg.exception('in main loop')
+            delay = backoff.next()
+            lg.warning('reconnecting in %.1f s, %s events buffered', delay, self.noolite.event_que.qsize())
+            await asyncio.sleep(delay)
+
+    async def run(self, client_factory=None):
+        """
+        Одновременно открывает порт и подключается к брокеру. Команды, пришедшие до открытия порта, ждут его в
+        очереди
+        :param client_factory: создает клиента mqtt, по умолчанию mqtt_client
+        :return:
+        """
+        serial = asyncio.ensure_future(self.noolite.open())
+        lag = asyncio.ensure_future(self.loop_lag.run())
+        mqtt = asyncio.ensure_future(self.process_mqtt(client_factory or self.mqtt_client))
+        try:
+            if self.metrics_port:
+                await self.metrics.serve(self.metrics_port, self.metrics_host)
+            await serial
+            startup['serial'] = time.monotonic() - STARTED
+            # шлюз - только для первого адаптера: у него каналы совпадают с адресами
+            if self.gateway_port and isinstance(self.adapters[0], noo.Noolite):
+                await noo.Gateway(self.adapters[0], allow_service=self.gateway_service).serve(
+                    self.gateway_port, self.gateway_host,
+                )
+            lg.info('startup: %s', ', '.join(f'{k} {v:.3f} s' for k, v in startup.items()))
+            for poller in self.pollers:
+                if poller.channels:
+                    # опрос идет независимо от соединения с брокером
+                    asyncio.ensure_future(poller.run())
+            await mqtt
+        finally:
+            serial.cancel()
+            mqtt.cancel()
+            lag.cancel()
+            self.noolite.close()
+            for adapter in self.adapters:
+                if adapter.capture is not None:
+                    adapter.capture.close()
+            # изменения последних SAVE_DELAY секунд иначе теряются
+            self.states.save()
+
+
+def setup(options_path: str = OPTIONS_PATH) -> App:
     """
+    Читает настройки и создает все объекты, ничего не подключая. Вызывается из запущенного eventloop
+    :param options_path:
     :return:
     """
-    await client.subscribe(topic_patt)
-    async with client.filtered_messages(topic_patt) as messages:
-        lg.debug(f'subscribe to {topic_patt}')
-        async for msg in messages:
-            lg.debug(f'process {msg.topic}: {msg.payload}')
-            try:
-                for cmd in parser(msg):
-                    await noolite.send_command(cmd)
-                # сообщаем что все ок
-                await client.publish(
-                    topic=response_template.format(ch=cmd.ch),
-                    payload=msg.payload,
-                    retain=True,
-                )
-            except Exception as exc:
-                await client.publish(
-                    topic=f'{ERR_PREFIX}/{cmd.ch}',
-                    payload=str(exc)
-                )
-                lg.exception()
+    return App(options_path)
 
 
-async def main():
-    while True:
-        async with Client(**MQTT_CONF) as client:
-            try:
-                await announce(client)
-                await client.publish(
-                    topic=ONLINE_TOPIC,
-                    payload='online',
-                )
-                done, pending = await asyncio.wait([
-                    process_msgs(
-                        client,
-                        topic_patt=SWITCH_SUBSCRIPTION,
-                        response_template=SWITCH_RESPONSE,
-                        parser=parse_msg
-                    ),
-                    process_msgs(
-                        client,
-                        topic_patt=RAW_SUBSCRIPTION,
-                        response_template=RAW_RESPONSE,
-                        parser=parse_raw
-                    ),
-                    process_noolite(client),
-                ], return_when=FIRST_EXCEPTION)
-                for x in done:
-                    await x
-            except Exception as exc:
-                lg.exception('in main loop')
-            finally:
-                await client.publish(**OFFLINE)
-        lg.warning('reconnecting')
-        await asyncio.sleep(RECONNECT_TIME)
+async def run(options_path: str = OPTIONS_PATH, client_factory=None):
+    """
+    Запуск по этапам: настройки, затем одновременно открытие порта и подключение к брокеру
+    :param options_path:
+    :param client_factory: создает клиента mqtt, по умолчанию App.mqtt_client
+    :return:
+    """
+    startup['import'] = time.monotonic() - STARTED
+    app = setup(options_path)
+    startup['config'] = time.monotonic() - STARTED
+    await app.run(client_factory)
+
+
+def main():
+    asyncio.run(run())
 
 
 if __name__ == '__main__':
-    loop.run_until_complete(main())
+    main()
@@ -1,3 +1,29 @@
-from .noolite import Noolite, NotApprovedError
-from .typing import NooliteCommand, MqttCommand
-from . import const
\ No newline at end of file
+from .noolite import Noolite, NotApprovedError, MAX_INFLIGHT, EVENT_BUFFER_SIZE
+from .typing import NooliteCommand, TempHumReading, MotionReading, StateReading, DeviceState, \
+    warm_cache, br_to_raw, raw_to_br
+from .dispatcher import Dispatcher, LANE_SIZE
+from .publisher import BatchPublisher
+from .state import StateCache, LightState
+from .poller import Poller
+from .scheduler import PriorityScheduler, PRIORITY_INTERACTIVE, PRIORITY_POLL, PRIORITY_SERVICE
+from .metrics import Metrics, Histogram, LoopLag
+from .decoder import FrameDecoder, decode_batch
+from .filters import EventFilter, SensorFilter, SensorSettings
+from .buffer import EventBuffer, Backoff, RingBuffer, DROP_OLDEST, DROP_NEWEST
+from .discovery import DiscoveryManifest
+from .transport import SerialTransport
+from .gateway import Gateway
+from .ethernet import NooliteEthernet, SENSOR_INTERVAL
+from .router import Router, CHANNELS, MAX_ADAPTERS
+from .capture import CaptureWriter, read_capture, replay, DIR_IN, DIR_OUT, DIR_ACK
+from .registry import Registry, Light, Motion, Group, Sensor
+from .codec import CodecError
+from . import const, codec, router
+
+
+def __getattr__(name):
+    # pydantic нужен только для MqttCommand, а импортируется долго - грузим при первом обращении
+    if name == 'MqttCommand':
+        from .models import MqttCommand
+        return MqttCommand
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
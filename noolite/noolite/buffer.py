@@ -0,0 +1,137 @@
+import asyncio
+import random
+import typing
+from collections import deque
+
+from logger import root_logger
+
+lg = root_logger.getChild('noolite')
+
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+
+
+class EventBuffer:
+    """
+    Ограниченная очередь входящих событий
+
+    При переполнении отбрасывает самое старое (DROP_OLDEST) или новое (DROP_NEWEST) событие. Событие, которое не
+    удалось опубликовать, возвращается в начало очереди (requeue), так что после переподключения к брокеру события
+    публикуются в исходном порядке
+    """
+
+    def __init__(self, maxsize: int = 1000, policy: str = DROP_OLDEST):
+        """
+        :param maxsize: максимальное кол-во событий
+        :param policy: DROP_OLDEST или DROP_NEWEST
+        """
+        assert policy in (DROP_OLDEST, DROP_NEWEST)
+        self.maxsize = maxsize
+        self.policy = policy
+        self.dropped = 0
+        self._items = deque()
+        self._event = asyncio.Event()
+
+    def qsize(self) -> int:
+        return len(self._items)
+
+    def empty(self) -> bool:
+        return not self._items
+
+    def put_nowait(self, item):
+        if len(self._items) >= self.maxsize:
+            self.dropped += 1
+            if self.policy == DROP_NEWEST:
+                lg.debug('event buffer full, drop %s', item)
+                return
+            lg.debug('event buffer full, drop %s', self._items[0])
+            self._items.popleft()
+        self._items.append(item)
+        self._event.set()
+
+    def requeue(self, item):
+        """
+        Возвращает событие в начало очереди, если очередь полна - событие теряется
+        :param item:
+        :return:
+        """
+        if len(self._items) >= self.maxsize:
+            self.dropped += 1
+            return
+        self._items.appendleft(item)
+        self._event.set()
+
+    def get_nowait(self):
+        return self._items.popleft()
+
+    async def get(self):
+        while not self._items:
+            self._event.clear()
+            await self._event.wait()
+        return self._items.popleft()
+
+
+class Backoff:
+    """
+    Экспоненциальная задержка с полным случайным разбросом (full jitter)
+    """
+
+    def __init__(self, base: float = 1., cap: float = 60., factor: float = 2.):
+        self.base = base
+        self.cap = cap
+        self.factor = factor
+        self.attempt = 0
+
+    def reset(self):
+        self.attempt = 0
+
+    def next(self) -> float:
+        delay = min(self.cap, self.base * self.factor ** self.attempt)
+        self.attempt += 1
+        return random.uniform(0, delay)
+
+
+class RingBuffer:
+    """
+    Кольцевой буфер фиксированного размера для чисел. Хранит сумму значений, так что среднее считается без прохода
+    по буферу
+    """
+    __slots__ = ('_items', '_pos', '_sum', 'count')
+
+    def __init__(self, size: int):
+        """
+        :param size: сколько последних значений хранить
+        """
+        assert size > 0
+        self._items = [0.] * size
+        self._pos = 0
+        self._sum = 0.
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def push(self, value: float):
+        """
+        Добавляет значение, самое старое при заполненном буфере вытесняется
+        :param value:
+        :return:
+        """
+        items = self._items
+        self._sum += value - items[self._pos]
+        items[self._pos] = value
+        self._pos = (self._pos + 1) % len(items)
+        if self.count < len(items):
+            self.count += 1
+
+    def mean(self) -> typing.Optional[float]:
+        return self._sum / self.count if self.count else None
+
+    def values(self) -> typing.List[float]:
+        """
+        Значения от старых к новым
+        :return:
+        """
+        if self.count < len(self._items):
+            return self._items[:self.count]
+        return self._items[self._pos:] + self._items[:self._pos]
@@ -0,0 +1,166 @@
+import asyncio
+import mmap
+import os
+import struct
+import time
+import typing
+from typing import Iterator, Optional
+
+from logger import root_logger
+
+lg = root_logger.getChild('noolite')
+
+MAGIC = b'NOOCAP1\n'
+HEADER = struct.Struct('<8sd')  # MAGIC, time.time() создания файла
+RECORD = struct.Struct('<dB17s')  # time.monotonic(), направление, кадр
+DIR_IN = 0  # входящее событие
+DIR_OUT = 1  # кадр в адаптер
+DIR_ACK = 2  # входящее подтверждение отправленной команды
+FLUSH_DELAY = 1  # через сколько секунд после записи буфер сбрасывается на диск
+FLUSH_SIZE = 64 * 1024
+
+
+class Record(typing.NamedTuple):
+    ts: float
+    direction: int
+    frame: bytes
+
+
+class CaptureWriter:
+    """
+    Запись всех кадров адаптера в обе стороны в бинарный файл
+
+    Файл только дописывается: заголовок, затем записи фиксированной длины RECORD.size. Записи копятся в памяти и
+    сбрасываются на диск раз в FLUSH_DELAY секунд или по заполнению буфера, так что запись не тормозит обработку
+    кадров. Оборванная последняя запись (например, при выключении питания) при чтении пропускается
+
+    Если задан max_size, файл, выросший больше max_size, переименовывается в <path>.1 (прежний <path>.1
+    удаляется) и запись начинается в новый файл, так что на диске не больше двух файлов примерно по max_size
+    """
+
+    def __init__(self, path: str, max_size: Optional[int] = None):
+        """
+        :param path: файл записи, если уже есть - дописывается
+        :param max_size: размер файла в байтах, после которого он заменяется новым, None - без ограничения
+        """
+        self.path = path
+        self.max_size = max_size
+        self.records = 0
+        self.rotations = 0
+        self._buf = bytearray()
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._open()
+
+    def _open(self):
+        self._file = open(self.path, 'ab')
+        if self._file.tell() < HEADER.size:
+            # пустой файл или оборванный заголовок - пишем заново
+            self._file.truncate(0)
+            self._file.write(HEADER.pack(MAGIC, time.time()))
+        else:
+            # дописываем после последней целой записи
+            tail = (self._file.tell() - HEADER.size) % RECORD.size
+            if tail:
+                self._file.truncate(self._file.tell() - tail)
+                self._file.seek(0, os.SEEK_END)
+
+    def _rotate(self):
+        self._file.close()
+        os.replace(self.path, f'{self.path}.1')
+        self.rotations += 1
+        self._open()
+
+    def record(self, direction: int, frame: typing.Union[bytes, bytearray]):
+        self._buf += RECORD.pack(time.monotonic(), direction, bytes(frame))
+        self.records += 1
+        if len(self._buf) >= FLUSH_SIZE:
+            self.flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_event_loop().call_later(FLUSH_DELAY, self.flush)
+
+    def flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._buf:
+            return
+        try:
+            self._file.write(self._buf)
+            self._file.flush()
+            if self.max_size and self._file.tell() >= self.max_size:
+                self._rotate()
+        except Exception:
+            lg.exception('writing %s', self.path)
+        self._buf.clear()
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+
+def read_capture(path: str) -> Iterator[Record]:
+    """
+    Читает записи через mmap, файл не загружается в память целиком
+    :param path:
+    :return:
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < HEADER.size:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            magic, _ = HEADER.unpack_from(mm)
+            if magic != MAGIC:
+                raise ValueError(f'{path}: not a capture file')
+            end = size - (size - HEADER.size) % RECORD.size
+            unpack, step = RECORD.unpack_from, RECORD.size
+            for pos in range(HEADER.size, end, step):
+                yield Record(*unpack(mm, pos))
+
+
+async def replay(
+        feed: typing.Callable[[bytes], typing.Any],
+        path: str,
+        speed: Optional[float] = 1.,
+        directions: typing.Collection[int] = (DIR_IN, ),
+        batch: int = 64,
+        max_gap: Optional[float] = None,
+) -> int:
+    """
+    Подает записанные кадры в feed (обычно Noolite.feed) с исходными интервалами
+
+    :param feed: получает байты кадра, как если бы они пришли из порта
+    :param path: файл записи
+    :param speed: 1 - в реальном времени, N - в N раз быстрее, None или 0 - без пауз
+    :param directions: какие записи подавать, по умолчанию только входящие события (подтверждения без
+        отправленных команд превратились бы в события)
+    :param batch: без пауз управление отдается eventloop раз в batch кадров
+    :param max_gap: паузы длиннее (по времени записи) сокращаются до max_gap, чтобы не ждать часами между
+        всплесками многодневной записи
+    :return: кол-во поданных кадров
+    """
+    loop = asyncio.get_event_loop()
+    start = loop.time()
+    first = prev = None
+    ret = 0
+    for ts, direction, frame in read_capture(path):
+        if direction not in directions:
+            continue
+        if first is None:
+            first = prev = ts
+        gap = ts - prev
+        if gap < 0:
+            # перезагрузка: monotonic начался заново, продолжаем без паузы
+            first += gap
+        elif max_gap is not None and gap > max_gap:
+            first += gap - max_gap
+        prev = ts
+        if speed:
+            delay = start + (ts - first) / speed - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        elif ret % batch == 0:
+            await asyncio.sleep(0)
+        feed(frame)
+        ret += 1
+    return ret
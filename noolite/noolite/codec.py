@@ -0,0 +1,148 @@
+"""
+Быстрый разбор сырых команд из mqtt без промежуточных моделей: json -> dict -> готовый кадр
+"""
+import typing
+from typing import Dict, Optional, Tuple
+
+from .typing import NooliteCommand, APPROVAL_TIMEOUT, FIELDS, br_to_raw
+
+try:
+    import orjson
+
+    loads = orjson.loads
+except ImportError:
+    import json
+
+    loads = json.loads
+
+FRAME_LEN = len(FIELDS)
+
+# поле -> (позиция в кадре, минимум, максимум), позиция None - поле не пишется в кадр напрямую
+SCHEMA: Dict[str, Tuple[Optional[int], int, int]] = {
+    name: (idx, 0, 255) for idx, name in enumerate(FIELDS) if name not in ('st', 'crc', 'sp')
+}
+SCHEMA.update(
+    nrep=(None, 0, 3),
+    br=(None, 0, 100),
+    duration=(None, 0, 0xFFFF * 5),
+)
+_TEMPLATE = bytes(NooliteCommand().frame)
+
+
+class CodecError(ValueError):
+    pass
+
+
+def _int(name: str, value) -> int:
+    if isinstance(value, int):
+        ret = value
+    elif isinstance(value, str) and value.strip().isdigit():
+        ret = int(value)
+    elif isinstance(value, float) and value.is_integer():
+        ret = int(value)
+    else:
+        raise CodecError(f'{name}: not an integer: {value!r}')
+    _, lo, hi = SCHEMA[name]
+    if not lo <= ret <= hi:
+        raise CodecError(f'{name}: {ret} not in [{lo}, {hi}]')
+    return ret
+
+
+def _commit(value) -> Optional[float]:
+    """
+    true - ждать подтверждения стандартное время, число - таймаут в секундах, false/0/null - не ждать
+    """
+    if value is True:
+        return APPROVAL_TIMEOUT
+    if value is False or value is None:
+        return None
+    if isinstance(value, (int, float)) and value >= 0:
+        return float(value) or None
+    raise CodecError(f'commit: bad timeout: {value!r}')
+
+
+def encode(data: dict, ch: Optional[int] = None) -> NooliteCommand:
+    """
+    Собирает кадр прямо из словаря, поля и ограничения как у MqttCommand, неизвестные поля игнорируются
+    :param data: поля команды
+    :param ch: канал, если задан - заменяет ch из data
+    :return:
+    """
+    if not isinstance(data, dict):
+        raise CodecError(f'expected object, got {type(data).__name__}')
+    frame = bytearray(_TEMPLATE)
+    nrep = br = duration = 0
+    commit = APPROVAL_TIMEOUT
+    for name, value in data.items():
+        spec = SCHEMA.get(name)
+        if spec is None:
+            if name == 'commit':
+                commit = _commit(value)
+            continue
+        value = _int(name, value)
+        if spec[0] is not None:
+            frame[spec[0]] = value
+        elif name == 'nrep':
+            nrep = value
+        elif name == 'br':
+            br = value
+        else:
+            duration = value
+    if ch is not None:
+        frame[4] = ch
+    # то же, что делает NooliteCommand.make_command
+    if duration:
+        frame[6] = 2
+        frame[7] = (duration // 5) & 0xFF
+        frame[8] = ((duration // 5) & 0xFF00) >> 8
+    if br:
+        frame[6] = 1
+        frame[7] = br_to_raw(br)
+    if nrep:
+        frame[2] |= nrep << 5
+    return NooliteCommand.from_bytes(frame, commit=commit)
+
+
+def decode_json(payload: typing.Union[bytes, str], ch: Optional[int] = None) -> NooliteCommand:
+    """
+    Сырая команда в json
+    :param payload:
+    :param ch:
+    :return:
+    """
+    try:
+        data = loads(payload)
+    except ValueError as exc:
+        raise CodecError(f'bad json: {exc}') from None
+    return encode(data, ch)
+
+
+def decode_frame(payload: typing.Union[bytes, str], ch: Optional[int] = None) -> NooliteCommand:
+    """
+    Готовый кадр: 17 байт, hex-строка (пробелы допускаются) или json-массив из 17 чисел. Контрольная сумма
+    пересчитывается, поэтому ее можно не заполнять
+    :param payload:
+    :param ch: канал, если задан - заменяет канал в кадре
+    :return:
+    """
+    if isinstance(payload, str):
+        payload = payload.encode()
+    if len(payload) == FRAME_LEN and payload[0] == _TEMPLATE[0]:
+        frame = bytearray(payload)
+    elif payload[:1] == b'[':
+        try:
+            frame = bytearray(loads(payload))
+        except (ValueError, TypeError) as exc:
+            raise CodecError(f'bad array: {exc}') from None
+    else:
+        try:
+            frame = bytearray.fromhex(payload.decode())
+        except ValueError as exc:
+            raise CodecError(f'bad hex: {exc}') from None
+    if len(frame) != FRAME_LEN:
+        raise CodecError(f'frame must be {FRAME_LEN} bytes, got {len(frame)}')
+    if frame[0] != _TEMPLATE[0] or frame[16] != _TEMPLATE[16]:
+        raise CodecError(f'bad frame start/stop: {frame[0]}/{frame[16]}')
+    if ch is not None:
+        frame[4] = ch
+    return NooliteCommand.from_bytes(frame)
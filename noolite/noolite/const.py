@@ -1,5 +1,5 @@
 from logger import root_logger
-from .typing import TempHumSensor, MotionSensor
+from .typing import TempHumSensor, MotionSensor, DeviceState
 
 lg = logger = root_logger.getChild('noolite')
 
@@ -39,14 +39,14 @@ dispatching_constructors = (
     (26	, None, 'modes 	', 'Установка режимов работы исполнительного устройства (см. описание B).'),
     (128	, None, 'read_state 	', 'Получение состояния исполнительного устройства (см. описание C).'),
     (129	, None, 'write_state 	', 'Установка состояния исполнительного устройства.'),
-    (130	, None, 'send_state 	', 'Ответ от исполнительного устройства (см. описание C).'),
+    (130	, DeviceState, 'send_state 	', 'Ответ от исполнительного устройства (см. описание C).'),
     (131	, None, 'service 	', 'Включение сервисного режима на заранее привязанном устройстве (см. описание D).'),
     (132	, None, 'clear_memory 	', 'Очистка памяти устройства nooLite. Для выполнения команды используется ключ 170- 85-170-85 (записывается в поле данных D0...D3).'),
 )
 api_commands = {x[2].strip().lower(): x[0] for x in dispatching_constructors}
 dispatchers = {x[0]: (x[1], x[2]) for x in dispatching_constructors}
-SENS_TEMP = '001'
-SENS_HUM_TEMP = '010'
+SENS_TEMP = 0b001  # PT112
+SENS_HUM_TEMP = 0b010  # PT111
 
 
 OFF = 0
@@ -78,6 +78,8 @@ SEND_STATE = 130
 SERVICE = 131
 CLEAR_MEMORY = 132
 
+SERVICE_COMMANDS = frozenset((BIND, UNBIND, SERVICE, CLEAR_MEMORY))
+
 services = {
     'BIND_TX': {'cmd': BIND, 'commit': None}
     , 'BIND_RX': {'mode': 1, 'ctr': 3, 'commit': 40}
@@ -0,0 +1,91 @@
+import typing
+from array import array
+
+from logger import root_logger
+from . import const
+from .typing import battery_status, sensor_type, temperature
+
+lg = root_logger.getChild('noolite')
+
+FRAME_LEN = 17
+
+
+class FrameDecoder:
+    """
+    Потоковый декодер кадров от адаптера
+
+    Принимает байты кусками любой длины, ищет начало кадра (F_IN_BEG), проверяет стоп-байт (F_IN_END) и
+    контрольную сумму. Если кадр битый, сдвигается на один байт и ищет следующее начало, так что после потери или
+    лишнего байта синхронизация восстанавливается на следующем же кадре
+    """
+
+    def __init__(self, beg: int = const.F_IN_BEG, end: int = const.F_IN_END):
+        self.beg = beg
+        self.end = end
+        self._buf = bytearray()
+        self.frames = 0  # кол-во принятых кадров
+        self.bad_frames = 0  # кол-во кадров, отброшенных из-за стоп-байта или контрольной суммы
+        self.dropped_bytes = 0  # кол-во байт, отброшенных при поиске начала кадра
+
+    def feed(self, data: bytes) -> typing.List[bytes]:
+        """
+        Добавляет пришедшие байты в буфер и возвращает все целые кадры, неполный хвост остается в буфере
+        :param data:
+        :return: список кадров по FRAME_LEN байт
+        """
+        buf = self._buf
+        buf += data
+        n = len(buf)
+        pos = 0
+        ret = []
+        with memoryview(buf) as mv:
+            while n - pos >= FRAME_LEN:
+                if buf[pos] != self.beg:
+                    nxt = buf.find(self.beg, pos + 1)
+                    if nxt < 0:
+                        nxt = n
+                    self.dropped_bytes += nxt - pos
+                    pos = nxt
+                    continue
+                stop = pos + FRAME_LEN
+                if buf[stop - 1] != self.end or sum(mv[pos:stop - 2]) & 0xFF != buf[stop - 2]:
+                    lg.debug('bad frame, resync')
+                    self.bad_frames += 1
+                    self.dropped_bytes += 1
+                    pos += 1
+                    continue
+                ret.append(bytes(mv[pos:stop]))
+                pos = stop
+        del buf[:pos]
+        self.frames += len(ret)
+        return ret
+
+
+def decode_batch(buf) -> typing.Dict[str, array]:
+    """
+    Разбирает буфер из подряд идущих кадров (например, из записи трафика) в колонки по датчикам
+    температуры/влажности, остальные кадры пропускаются. Для датчиков без влажности hum = -1
+    :param buf: bytes-like, длина кратна FRAME_LEN (хвост отбрасывается)
+    :return: {'ch': array('B'), 'temp': array('d'), 'hum': array('h'), 'battery': array('B')}
+    """
+    ret = {
+        'ch': array('B'),
+        'temp': array('d'),
+        'hum': array('h'),
+        'battery': array('B'),
+    }
+    n = len(buf) // FRAME_LEN * FRAME_LEN
+    with memoryview(buf) as mv:
+        frames = mv[:n]
+        # срезы с шагом FRAME_LEN дают колонки байтов без разбора каждого кадра
+        columns = zip(frames[5::FRAME_LEN], frames[4::FRAME_LEN], frames[7::FRAME_LEN], frames[8::FRAME_LEN],
+                      frames[9::FRAME_LEN])
+        for cmd, ch, d0, d1, d2 in columns:
+            if cmd != const.SENS_TEMP_HUMI:
+                continue
+            ret['ch'].append(ch)
+            ret['temp'].append(temperature(d0, d1))
+            ret['hum'].append(d2 if sensor_type(d1) == const.SENS_HUM_TEMP else -1)
+            ret['battery'].append(battery_status(d1))
+        frames.release()
+    return ret
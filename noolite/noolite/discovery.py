@@ -0,0 +1,67 @@
+import hashlib
+import json
+import os
+import typing
+
+from logger import root_logger
+
+lg = root_logger.getChild('noolite')
+
+
+def payload_hash(payload: str) -> str:
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+class DiscoveryManifest:
+    """
+    Список опубликованных конфигов discovery Home Assistant: топик -> хеш содержимого
+
+    Конфиги публикуются с retain, поэтому повторно публиковать нужно только те, что изменились с прошлой публикации
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: файл, в котором хранится манифест
+        """
+        self.path = path
+        self.published: typing.Dict[str, str] = {}
+        try:
+            with open(path) as f:
+                self.published = json.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception:
+            lg.exception('loading %s', path)
+
+    def diff(self, configs: typing.Dict[str, str], force: bool = False) -> typing.Dict[str, str]:
+        """
+        Возвращает конфиги, которые нужно опубликовать: новые и изменившиеся, а для топиков, которых больше нет в
+        конфигурации - пустой payload (удаляет сущность из HA)
+        :param configs: топик -> payload
+        :param force: все конфиги, а не только изменившиеся - например, если брокер потерял retain-сообщения
+        :return: топик -> payload
+        """
+        ret = {
+            topic: payload
+            for topic, payload in configs.items()
+            if force or self.published.get(topic) != payload_hash(payload)
+        }
+        for topic in self.published.keys() - configs.keys():
+            ret[topic] = ''
+        return ret
+
+    def update(self, published: typing.Dict[str, str]):
+        """
+        Запоминает опубликованные конфиги и сохраняет манифест
+        :param published: топик -> payload
+        :return:
+        """
+        for topic, payload in published.items():
+            if payload:
+                self.published[topic] = payload_hash(payload)
+            else:
+                self.published.pop(topic, None)
+        tmp = f'{self.path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.published, f)
+        os.replace(tmp, self.path)
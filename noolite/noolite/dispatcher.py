@@ -0,0 +1,85 @@
+import asyncio
+import typing
+from collections import deque
+from typing import Callable, Awaitable, Dict, Hashable
+
+from logger import root_logger
+
+lg = root_logger.getChild('noolite')
+
+LANE_SIZE = 16
+
+
+class Dispatcher:
+    """
+    Раздает сообщения по полосам (lanes), по одной на ключ (обычно канал)
+
+    Внутри полосы сообщения обрабатываются строго по порядку, разные полосы - параллельно. Полоса ограничена
+    lane_size, если она заполнена - put ждет освобождения места, так что читающий сообщения брокера цикл
+    приостанавливается. Сообщения, поставленные с coalesce=True, заменяют еще не обработанное последнее сообщение
+    полосы, если оно тоже было поставлено с coalesce=True (например, промежуточные значения ползунка яркости)
+    """
+
+    def __init__(self, handler: Callable[[Hashable, typing.Any], Awaitable], lane_size: int = LANE_SIZE):
+        """
+        :param handler: корутина-обработчик, вызывается с (key, item)
+        :param lane_size: максимальная длина полосы
+        """
+        self.handler = handler
+        self.lane_size = lane_size
+        self._lanes: Dict[Hashable, deque] = {}
+        self._workers: Dict[Hashable, asyncio.Task] = {}
+        self._space = asyncio.Condition()
+        self.coalesced = 0  # кол-во замененных сообщений
+        self.waits = 0  # сколько раз put ждал освобождения места
+        self.max_depth = 0  # максимальная длина полосы за все время
+
+    async def put(self, key: Hashable, item, coalesce: bool = False):
+        """
+        Ставит сообщение в полосу key
+        :param key:
+        :param item:
+        :param coalesce: можно ли заменить это сообщение следующим
+        :return:
+        """
+        lane = self._lanes.get(key)
+        if lane is None:
+            lane = self._lanes[key] = deque()
+        if coalesce and lane and lane[-1][1]:
+            lg.debug('coalesce %s: drop %s', key, lane[-1][0])
+            lane[-1] = (item, coalesce)
+            self.coalesced += 1
+            return
+        if len(lane) >= self.lane_size:
+            self.waits += 1
+            async with self._space:
+                await self._space.wait_for(lambda: len(lane) < self.lane_size)
+        lane.append((item, coalesce))
+        if len(lane) > self.max_depth:
+            self.max_depth = len(lane)
+        if key not in self._workers:
+            self._workers[key] = asyncio.ensure_future(self._work(key, lane))
+
+    async def _work(self, key: Hashable, lane: deque):
+        try:
+            while lane:
+                item, _ = lane.popleft()
+                async with self._space:
+                    self._space.notify_all()
+                try:
+                    await self.handler(key, item)
+                except Exception:
+                    lg.exception('handling %s', key)
+        finally:
+            self._workers.pop(key, None)
+
+    def depths(self) -> Dict[Hashable, int]:
+        """
+        Текущая длина каждой полосы
+        :return:
+        """
+        return {key: len(lane) for key, lane in self._lanes.items()}
+
+    @property
+    def depth(self) -> int:
+        return sum(len(lane) for lane in self._lanes.values())
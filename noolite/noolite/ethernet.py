@@ -0,0 +1,212 @@
+"""
+Ethernet-шлюз nooLite PR1132: команды отправляются запросами api.htm, показания датчиков температуры/влажности
+(до 4 штук, PT111/PT112) читаются опросом sens.xml
+
+Интерфейс тот же, что у Noolite: open, close, send_command, in_commands. Все запросы идут через одну
+ClientSession с пулом keep-alive соединений, так что соединение не устанавливается заново на каждую команду и
+каждый опрос. В буфер событий попадают только изменившиеся показания (TempHumReading), поэтому опрашивать
+можно часто
+"""
+import asyncio
+import typing
+from typing import Dict, Optional
+from xml.etree.ElementTree import XMLPullParser
+
+from logger import root_logger
+from . import const
+from .noolite import NooliteBase, NotApprovedError
+from .typing import NooliteCommand, TempHumReading
+
+lg = root_logger.getChild('noolite')
+
+SENSORS = 4  # сколько датчиков можно привязать к PR1132
+SENSOR_INTERVAL = 5  # период опроса sens.xml по умолчанию, сек
+REQUEST_TIMEOUT = 5
+KEEPALIVE_TIMEOUT = 60  # сколько держать открытым простаивающее соединение, сек
+# snt<n> в sens.xml - состояние датчика
+SENSOR_BOUND = 0  # привязан, показания есть
+SENSOR_NOT_BOUND = 1
+SENSOR_NO_SIGNAL = 2
+SENSOR_BATTERY_LOW = 3
+NO_ANALOG = 255  # у PR1132 нет значения аналогового входа датчика, как у TempHumReading по умолчанию
+
+
+class NooliteEthernet(NooliteBase):
+
+    def __init__(
+            self,
+            host: str,
+            loop: typing.Optional[asyncio.AbstractEventLoop],
+            sensor_interval: Optional[float] = SENSOR_INTERVAL,
+            timeout: float = REQUEST_TIMEOUT,
+            **kwargs,
+    ):
+        """
+        :param host: адрес шлюза, http://192.168.0.168
+        :param loop: eventloop
+        :param sensor_interval: период опроса sens.xml, сек, None или 0 - датчики не опрашиваются
+        :param timeout: таймаут запроса, сек
+        :param kwargs: max_inflight (сколько запросов api.htm на разные каналы выполняется одновременно),
+            event_buffer_size, event_drop_policy, sensor_filter (получает только изменившиеся показания) - см.
+            NooliteBase
+
+        Подтверждений от устройств PR1132 не получает: команда считается выполненной, когда шлюз ответил 200 OK.
+        Запросы на разные каналы выполняются одновременно по нескольким соединениям, на один канал - по порядку
+        """
+        super().__init__(loop, **kwargs)
+        self.host = host.rstrip('/')
+        self.tty_name = self.host
+        self.api_url = f'{self.host}/api.htm'
+        self.sensors_url = f'{self.host}/sens.xml'
+        self.sensor_interval = sensor_interval
+        self.timeout = timeout
+        self.session = None
+        # последние опубликованные показания по номеру датчика
+        self.sensors: Dict[int, TempHumReading] = {}
+        self.polls = 0
+        self.poll_failures = 0
+        self._ready = asyncio.Event()
+        self._poller: Optional[asyncio.Future] = None
+
+    async def open(self):
+        """
+        Создает сессию и, если задан sensor_interval, запускает опрос датчиков. Первый опрос выполняется сразу, так
+        что недоступный шлюз дает ошибку здесь, как неоткрывающийся порт у Noolite
+        :return:
+        """
+        import aiohttp
+        connector = aiohttp.TCPConnector(
+            # каждый одновременный запрос команды на своем соединении и еще одно на опрос датчиков
+            limit=self.max_inflight + 1,
+            keepalive_timeout=KEEPALIVE_TIMEOUT,
+        )
+        self.session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+        try:
+            if self.sensor_interval:
+                await self.poll()
+        except Exception:
+            await self.session.close()
+            self.session = None
+            raise
+        self._ready.set()
+        if self.sensor_interval:
+            self._poller = asyncio.ensure_future(self._poll_loop())
+        lg.info('%s opened', self.host)
+
+    def close(self):
+        self._ready.clear()
+        if self._poller is not None:
+            self._poller.cancel()
+            self._poller = None
+        if self.session is not None:
+            asyncio.ensure_future(self.session.close())
+            self.session = None
+
+    async def _send(self, command: typing.Union[NooliteCommand, bytes, bytearray], priority: typing.Optional[int]):
+        frame, commit, priority, scheduler = self._lane(command, priority)
+        ch = frame[4]
+        params = api_params(frame)
+        async with self._channel_lock(ch):
+            async with scheduler.slot(priority):
+                while self.session is None:
+                    await self._ready.wait()
+                lg.debug('> %s', params)
+                sent = self.loop.time()
+                try:
+                    async with self.session.get(self.api_url, params=params) as resp:
+                        await resp.read()
+                        resp.raise_for_status()
+                except Exception as exc:
+                    self.not_approved[ch] += 1
+                    raise NotApprovedError(command) from exc
+                self.frames_out += 1
+                self.ack_latency.observe(self.loop.time() - sent)
+                return True
+
+    async def poll(self) -> int:
+        """
+        Читает sens.xml и кладет в буфер событий показания датчиков, изменившиеся с прошлого опроса
+
+        Ответ разбирается потоково по мере получения, документ целиком в памяти не собирается
+        :return: кол-во изменившихся датчиков
+        """
+        values: Dict[str, str] = {}
+        parser = XMLPullParser(('end', ))
+        async with self.session.get(self.sensors_url) as resp:
+            resp.raise_for_status()
+            async for chunk in resp.content.iter_any():
+                parser.feed(chunk)
+                for _, elem in parser.read_events():
+                    if elem.tag.startswith('sn'):
+                        values[elem.tag] = elem.text
+        parser.close()
+        self.polls += 1
+        changed = 0
+        for n in range(SENSORS):
+            reading = sensor_reading(n + self.channel_offset, n, values)
+            if reading is None or reading == self.sensors.get(n):
+                continue
+            self.sensors[n] = reading
+            self.put_reading(reading)
+            changed += 1
+        return changed
+
+    async def _poll_loop(self):
+        while True:
+            await asyncio.sleep(self.sensor_interval)
+            try:
+                await self.poll()
+            except Exception as exc:
+                self.poll_failures += 1
+                lg.warning('polling %s: %r', self.sensors_url, exc)
+
+
+def api_params(frame: typing.Union[bytes, bytearray]) -> Dict[str, int]:
+    """
+    Параметры запроса api.htm для кадра MTRF-64
+    :param frame: 17 байт
+    :return:
+    """
+    mode, ch, cmd, fmt = frame[1], frame[4], frame[5], frame[6]
+    if mode != 0:
+        # PR1132 - передатчик nooLite, режимов nooLite-F и сервисных режимов адаптера у него нет
+        raise ValueError(f'PR1132 supports nooLite TX mode only, got mode {mode}')
+    ret = {'ch': ch, 'cmd': cmd}
+    if cmd == const.SET_BRIGHTNESS and fmt == 1:
+        ret['br'] = frame[7]
+    elif fmt:
+        ret['fmt'] = fmt
+        for i in range(4):
+            ret[f'd{i}'] = frame[7 + i]
+    return ret
+
+
+def _number(text: typing.Optional[str]) -> typing.Optional[float]:
+    # нет показаний - PR1132 пишет прочерк
+    try:
+        return float(text)
+    except (TypeError, ValueError):
+        return None
+
+
+def sensor_reading(ch: int, n: int, values: Dict[str, str]) -> typing.Optional[TempHumReading]:
+    """
+    Показания датчика n из разобранного sens.xml: snst<n> - температура, snsh<n> - влажность, snt<n> - состояние
+    :param ch: канал в показаниях
+    :param n: номер датчика
+    :param values: текст элементов по имени
+    :return: None, если датчик не привязан или нет сигнала
+    """
+    status = _number(values.get(f'snt{n}'))
+    temp = _number(values.get(f'snst{n}'))
+    if temp is None or status in (None, SENSOR_NOT_BOUND, SENSOR_NO_SIGNAL):
+        return None
+    hum = _number(values.get(f'snsh{n}'))
+    return TempHumReading(
+        ch,
+        const.SENS_TEMP if hum is None else const.SENS_HUM_TEMP,
+        temp,
+        None if hum is None else int(hum),
+        1 if status == SENSOR_BATTERY_LOW else 0,
+        NO_ANALOG,
+    )
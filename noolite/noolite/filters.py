@@ -0,0 +1,173 @@
+import time
+import typing
+from collections import Counter
+from typing import Dict, Tuple, Callable
+
+from . import const
+from .buffer import RingBuffer
+from .typing import TempHumReading
+
+Key = Tuple[int, int]
+
+
+class EventFilter:
+    """
+    Антидребезг входящих событий
+
+    Событие (ch, cmd), пришедшее раньше чем через окно после предыдущего такого же события, отбрасывается. Окно
+    задается на команду (по умолчанию) и может быть переопределено для конкретного канала. Время считается по
+    монотонным часам, так что переводы системного времени (NTP) на фильтр не влияют
+    """
+
+    def __init__(
+            self,
+            defaults: typing.Optional[Dict[int, float]] = None,
+            clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        :param defaults: окна по умолчанию, cmd -> сек
+        :param clock: источник времени
+        """
+        self.defaults: Dict[int, float] = {const.TEMPORARY_ON: const.MOTION_JITTER} if defaults is None else defaults
+        self.windows: Dict[Key, float] = {}
+        self.clock = clock
+        self.suppressed: typing.Counter[Key] = Counter()
+        self._last: Dict[Key, float] = {}
+
+    def set_window(self, ch: int, cmd: int, window: float):
+        """
+        Задает окно антидребезга для канала и команды, 0 - фильтр выключен
+        :param ch:
+        :param cmd:
+        :param window: сек
+        :return:
+        """
+        self.windows[(ch, cmd)] = window
+
+    def accept(self, ch: int, cmd: int) -> bool:
+        """
+        Возвращает истину, если событие нужно пропустить дальше
+        :param ch:
+        :param cmd:
+        :return:
+        """
+        key = (ch, cmd)
+        window = self.windows.get(key)
+        if window is None:
+            window = self.defaults.get(cmd)
+        if not window:
+            return True
+        now = self.clock()
+        last = self._last.get(key)
+        self._last[key] = now
+        if last is not None and now - last < window:
+            self.suppressed[key] += 1
+            return False
+        return True
+
+    @property
+    def total_suppressed(self) -> int:
+        return sum(self.suppressed.values())
+
+
+class SensorSettings(typing.NamedTuple):
+    """
+    Настройки прореживания показаний одного датчика температуры/влажности
+    """
+    temp_deadband: float = 0.2  # изменение температуры меньше этого не публикуется, °C
+    hum_deadband: float = 2.  # то же для влажности, %
+    min_interval: float = 60.  # публикуется не чаще, сек
+    max_interval: float = 900.  # и не реже (если датчик присылает показания), сек
+    window: int = 3  # сколько последних показаний усредняется
+
+
+class _SensorState:
+    __slots__ = ('settings', 'temp', 'hum', 'published', 'published_at')
+
+    def __init__(self, settings: SensorSettings):
+        self.settings = settings
+        self.temp = RingBuffer(settings.window)
+        self.hum = RingBuffer(settings.window)
+        self.published: typing.Optional[TempHumReading] = None
+        self.published_at = 0.
+
+
+class SensorFilter:
+    """
+    Прореживание показаний датчиков температуры/влажности
+
+    Датчики повторяют показания каждые несколько секунд, даже если ничего не изменилось. Показание добавляется в
+    кольцевой буфер датчика, дальше идет скользящее среднее по буферу. Оно пропускается, если ушло от последнего
+    пропущенного больше чем на мертвую зону, но не чаще min_interval, и в любом случае раз в max_interval.
+    Изменение состояния батареи пропускается сразу
+    """
+
+    def __init__(
+            self,
+            default: typing.Optional[SensorSettings] = None,
+            clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        :param default: настройки для датчиков без своих настроек
+        :param clock: источник времени
+        """
+        self.default = SensorSettings() if default is None else default
+        self.settings: Dict[int, SensorSettings] = {}
+        self.clock = clock
+        self.received = 0
+        self.published = 0
+        self._sensors: Dict[int, _SensorState] = {}
+
+    def configure(self, ch: int, settings: SensorSettings):
+        """
+        Задает настройки датчика, накопленные показания датчика сбрасываются
+        :param ch:
+        :param settings:
+        :return:
+        """
+        self.settings[ch] = settings
+        self._sensors.pop(ch, None)
+
+    def accept(self, reading: TempHumReading) -> typing.Optional[TempHumReading]:
+        """
+        Учитывает показание
+        :param reading:
+        :return: усредненное показание, если его нужно опубликовать, иначе None
+        """
+        self.received += 1
+        state = self._sensors.get(reading.ch)
+        if state is None:
+            state = self._sensors[reading.ch] = _SensorState(self.settings.get(reading.ch, self.default))
+        state.temp.push(reading.temp)
+        if reading.hum is not None:
+            state.hum.push(reading.hum)
+        avg = reading._replace(
+            temp=round(state.temp.mean(), 1),
+            hum=None if reading.hum is None else round(state.hum.mean()),
+        )
+        now = self.clock()
+        last = state.published
+        if last is not None and last.battery == avg.battery:
+            settings = state.settings
+            elapsed = now - state.published_at
+            if elapsed < settings.min_interval:
+                return None
+            if elapsed < settings.max_interval and not _changed(last, avg, settings):
+                return None
+        state.published = avg
+        state.published_at = now
+        self.published += 1
+        return avg
+
+    @property
+    def suppressed(self) -> int:
+        return self.received - self.published
+
+
+def _changed(last: TempHumReading, new: TempHumReading, settings: SensorSettings) -> bool:
+    # температуры округлены до десятых, без округления разницы 21.7 - 21.5 < 0.2
+    if round(abs(new.temp - last.temp), 1) >= settings.temp_deadband:
+        return True
+    if (new.hum is None) != (last.hum is None):
+        return True
+    return new.hum is not None and abs(new.hum - last.hum) >= settings.hum_deadband
@@ -0,0 +1,155 @@
+"""
+Шлюз: один адаптер MTRF-64 на несколько клиентов по TCP
+
+Клиент - обычный Noolite с портом tcp://host:port. Входящие события адаптера рассылаются всем клиентам,
+кадры клиентов отправляются в адаптер через общую очередь Noolite (порядок по каналам, подтверждения), а
+подтверждение возвращается только тому клиенту, который отправил команду
+
+Аутентификации нет: по умолчанию сервер слушает только DEFAULT_HOST, а сервисные кадры клиентов (привязка,
+отвязка, очистка памяти адаптера) отбрасываются, если шлюз создан без allow_service
+
+Отдельный запуск на машине с адаптером: python -m noolite.gateway /dev/ttyUSB0 --host 0.0.0.0 --port 9900
+"""
+import argparse
+import asyncio
+import typing
+from typing import Set
+
+from logger import root_logger
+from . import const
+from .decoder import FrameDecoder
+from .noolite import Noolite, NotApprovedError
+from .typing import NooliteCommand
+
+lg = root_logger.getChild('noolite')
+
+SERVICE_TIMEOUT = 60  # сколько ждать ответа на сервисные команды (привязка и т.п.), сек
+CLIENT_BUFFER_LIMIT = 64 * 1024  # клиент, не забирающий данные, отключается при таком объеме неотправленного
+DEFAULT_HOST = '127.0.0.1'
+
+
+class GatewayClient(asyncio.Protocol):
+    """
+    Соединение с одним клиентом шлюза
+    """
+
+    def __init__(self, gateway: 'Gateway'):
+        self.gateway = gateway
+        self.transport: typing.Optional[asyncio.Transport] = None
+        self.decoder = FrameDecoder(beg=const.F_OUT_BEG, end=const.F_OUT_END)
+        self.peer = None
+
+    def connection_made(self, transport: asyncio.Transport):
+        self.transport = transport
+        self.peer = transport.get_extra_info('peername')
+        self.gateway.clients.add(self)
+        lg.info('gateway client %s connected', self.peer)
+
+    def connection_lost(self, exc: typing.Optional[Exception]):
+        self.gateway.clients.discard(self)
+        self.transport = None
+        lg.info('gateway client %s disconnected: %r', self.peer, exc)
+
+    def data_received(self, data: bytes):
+        for frame in self.decoder.feed(data):
+            command = NooliteCommand.from_bytes(frame)
+            if command.is_service:
+                if not self.gateway.allow_service:
+                    lg.warning('gateway client %s: service command rejected: %s', self.peer, command)
+                    continue
+                command.commit = SERVICE_TIMEOUT
+            # задачи стартуют по порядку, блокировки каналов в Noolite сохраняют этот порядок
+            asyncio.ensure_future(self._send(command))
+
+    async def _send(self, command: NooliteCommand):
+        try:
+            ack = await self.gateway.noolite.send_command(command)
+        except NotApprovedError:
+            # клиент сам дождется своего таймаута
+            return
+        except Exception:
+            lg.exception('gateway client %s: sending %s', self.peer, command)
+            return
+        # ответ на READ_STATE уже разослан всем как событие
+        if isinstance(ack, NooliteCommand) and ack.cmd != const.SEND_STATE:
+            self.write(bytes(ack.frame))
+
+    def write(self, data: bytes):
+        transport = self.transport
+        if transport is None or transport.is_closing():
+            return
+        if transport.get_write_buffer_size() > CLIENT_BUFFER_LIMIT:
+            lg.warning('gateway client %s is not reading, disconnecting', self.peer)
+            transport.abort()
+            return
+        transport.write(data)
+
+
+class Gateway:
+    """
+    TCP-сервер, разделяющий адаптер между клиентами
+    """
+
+    def __init__(self, noolite: Noolite, allow_service: bool = False):
+        """
+        :param noolite: адаптер
+        :param allow_service: принимать от клиентов сервисные кадры (привязка, отвязка, очистка памяти адаптера)
+        """
+        self.noolite = noolite
+        self.allow_service = allow_service
+        self.clients: Set[GatewayClient] = set()
+        self.server: typing.Optional[asyncio.AbstractServer] = None
+
+    def _broadcast(self, chunk: bytes):
+        for client in tuple(self.clients):
+            client.write(chunk)
+
+    async def serve(self, port: int, host: str = DEFAULT_HOST) -> asyncio.AbstractServer:
+        """
+        Запускает сервер, входящие кадры адаптера с этого момента рассылаются клиентам
+        :param port:
+        :param host: адрес, на котором слушать, 0.0.0.0 - на всех интерфейсах
+        :return:
+        """
+        self.noolite.taps.append(self._broadcast)
+        self.server = await asyncio.get_running_loop().create_server(lambda: GatewayClient(self), host, port)
+        lg.info('gateway on %s:%s', host, port)
+        return self.server
+
+    def close(self):
+        if self._broadcast in self.noolite.taps:
+            self.noolite.taps.remove(self._broadcast)
+        if self.server is not None:
+            self.server.close()
+        for client in tuple(self.clients):
+            if client.transport is not None:
+                client.transport.close()
+
+
+async def _run(tty_name: str, host: str, port: int, allow_service: bool):
+    loop = asyncio.get_running_loop()
+    noolite = Noolite(tty_name, loop)
+    await noolite.open()
+    gateway = Gateway(noolite, allow_service=allow_service)
+    await gateway.serve(port, host)
+    try:
+        # входящие события клиенты получают через рассылку, локальный буфер просто опустошается
+        async for _ in noolite.in_commands:
+            pass
+    finally:
+        gateway.close()
+        noolite.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='nooLite MTRF-64 TCP gateway')
+    parser.add_argument('tty')
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=9900)
+    parser.add_argument('--allow-service', action='store_true', help='принимать от клиентов привязку и отвязку')
+    args = parser.parse_args()
+    asyncio.run(_run(args.tty, args.host, args.port, args.allow_service))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+import asyncio
+import typing
+from bisect import bisect_left
+from typing import Callable, Dict, List, Tuple, Union
+
+from logger import root_logger
+
+lg = root_logger.getChild('noolite')
+
+DEFAULT_HOST = '127.0.0.1'  # адрес http-сервера метрик по умолчанию
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10.)
+LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.)
+Labels = Union[str, Tuple[str, ...]]
+
+
+class Histogram:
+    """
+    Гистограмма с фиксированными границами корзин, observe - O(log n) без аллокаций
+    """
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: typing.Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        """
+        Накопительные значения корзин в формате prometheus (le -> кол-во)
+        :return:
+        """
+        ret = []
+        total = 0
+        for le, n in zip(self.buckets + (float('inf'),), self.counts):
+            total += n
+            ret.append(('+Inf' if le == float('inf') else repr(le), total))
+        return ret
+
+
+class LoopLag:
+    """
+    Задержка eventloop: на сколько позже заданного просыпается asyncio.sleep(interval). Если что-то блокирует
+    eventloop (синхронный ввод-вывод, долгие вычисления), задержка растет
+    """
+
+    def __init__(self, interval: float = 0.1, buckets: typing.Sequence[float] = LAG_BUCKETS):
+        """
+        :param interval: период измерения, сек
+        :param buckets: границы корзин гистограммы
+        """
+        self.interval = interval
+        self.hist = Histogram(buckets)
+        self.max = 0.
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        interval = self.interval
+        while True:
+            t = loop.time()
+            await asyncio.sleep(interval)
+            lag = max(0., loop.time() - t - interval)
+            self.hist.observe(lag)
+            if lag > self.max:
+                self.max = lag
+
+
+class Metrics:
+    """
+    Реестр метрик
+
+    Метрики не считаются в момент события: компоненты держат простые счетчики, а реестр читает их функциями только
+    при сборе (render/snapshot), поэтому на горячем пути метрики почти ничего не стоят.
+    Функция метрики возвращает число, либо словарь значение метки -> число (метка задается в label)
+    """
+
+    def __init__(self):
+        self._metrics: List[Tuple[str, str, str, Callable, typing.Optional[Labels]]] = []
+
+    def _add(self, kind: str, name: str, help: str, fn: Callable, label: typing.Optional[Labels]):
+        self._metrics.append((name, kind, help, fn, label))
+
+    def counter(self, name: str, help: str, fn: Callable, label: typing.Optional[Labels] = None):
+        self._add('counter', name, help, fn, label)
+
+    def gauge(self, name: str, help: str, fn: Callable, label: typing.Optional[Labels] = None):
+        self._add('gauge', name, help, fn, label)
+
+    def histogram(self, name: str, help: str, hist: Histogram):
+        self._add('histogram', name, help, lambda: hist, None)
+
+    @staticmethod
+    def _labels(label: Labels, key) -> str:
+        if isinstance(label, str):
+            label, key = (label,), (key,)
+        return ','.join(f'{name}="{value}"' for name, value in zip(label, key))
+
+    def render(self) -> str:
+        """
+        Все метрики в текстовом формате prometheus
+        :return:
+        """
+        lines = []
+        for name, kind, help, fn, label in self._metrics:
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            value = fn()
+            if isinstance(value, Histogram):
+                for le, n in value.cumulative():
+                    lines.append(f'{name}_bucket{{le="{le}"}} {n}')
+                lines.append(f'{name}_sum {value.sum}')
+                lines.append(f'{name}_count {value.count}')
+            elif isinstance(value, dict):
+                for key, n in value.items():
+                    lines.append(f'{name}{{{self._labels(label, key)}}} {n}')
+            else:
+                lines.append(f'{name} {value}')
+        lines.append('')
+        return '\n'.join(lines)
+
+    def snapshot(self) -> Dict[str, typing.Any]:
+        """
+        Все метрики в виде словаря для публикации в mqtt
+        :return:
+        """
+        ret = {}
+        for name, kind, help, fn, label in self._metrics:
+            value = fn()
+            if isinstance(value, Histogram):
+                value = {'count': value.count, 'sum': value.sum, 'buckets': dict(value.cumulative())}
+            elif isinstance(value, dict):
+                value = {str(key): n for key, n in value.items()}
+            ret[name] = value
+        return ret
+
+    async def serve(self, port: int, host: str = DEFAULT_HOST) -> asyncio.AbstractServer:
+        """
+        Запускает http-сервер, отдающий метрики в формате prometheus на любой GET-запрос
+        :param port:
+        :param host: адрес, на котором слушать, по умолчанию только локальные подключения
+        :return:
+        """
+        async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+            try:
+                await reader.readuntil(b'\r\n\r\n')
+                body = self.render().encode()
+                writer.write(
+                    b'HTTP/1.0 200 OK\r\n'
+                    b'Content-Type: text/plain; version=0.0.4\r\n'
+                    b'Content-Length: ' + str(len(body)).encode() + b'\r\n\r\n' + body
+                )
+                await writer.drain()
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                pass
+            except Exception:
+                lg.exception('serving metrics')
+            finally:
+                writer.close()
+
+        lg.info('metrics on %s:%s', host, port)
+        return await asyncio.start_server(handle, host, port)
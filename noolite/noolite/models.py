@@ -0,0 +1,29 @@
+import typing
+
+import pydantic
+
+from .typing import APPROVAL_TIMEOUT
+
+
+class MqttCommand(pydantic.BaseModel):
+    """
+    Контейнер для безопасного переноса команды из json
+    """
+    mode: int = 0
+    ctr: int = 0
+    togl: int = 0
+    ch: int = 0
+    cmd: int = 0
+    fmt: int = 0
+    d0: int = 0
+    d1: int = 0
+    d2: int = 0
+    d3: int = 0
+    id0: int = 0
+    id1: int = 0
+    id2: int = 0
+    id3: int = 0
+    commit: typing.Optional[float] = APPROVAL_TIMEOUT
+    nrep: int = 0
+    br: int = 0
+    duration: int = 0
@@ -1,65 +1,78 @@
+import abc
 import asyncio
-from datetime import datetime
-
-import serial
+from collections import Counter
+from urllib.parse import urlsplit
 
 from logger import root_logger
 from . import const
-from .typing import NooliteCommand, BaseNooliteRemote, MotionSensor
-from typing import Dict, Callable
+from .decoder import FrameDecoder
+from .filters import EventFilter, SensorFilter
+from .buffer import EventBuffer, Backoff, DROP_OLDEST
+from .capture import CaptureWriter, DIR_IN, DIR_OUT, DIR_ACK
+from .metrics import Histogram
+from .scheduler import PriorityScheduler, PRIORITY_INTERACTIVE, PRIORITY_SERVICE
+from .transport import SerialTransport
+from .typing import NooliteCommand, BaseNooliteRemote, TempHumReading
+from typing import Dict, Callable, Tuple
 import typing
 
+if typing.TYPE_CHECKING:
+    import serial
+
 lg = root_logger.getChild('noolite')
 
+MAX_INFLIGHT = 4  # сколько команд на разные каналы может одновременно ждать подтверждения
+FRAME_GAP = 0.05  # минимальная пауза между кадрами, отправляемыми в адаптер
+EVENT_BUFFER_SIZE = 1000
+REOPEN_TIME_MIN = 1
+REOPEN_TIME_MAX = 30
+
 
 class NotApprovedError(Exception):
     pass
 
 
-class Noolite:
+class NooliteBase(abc.ABC):
+    """
+    Общая часть адаптеров: очередь отправки (порядок по каналам, приоритеты), буфер входящих событий, счетчики.
+    Наследник реализует open, close и _send
+    """
+    capture: typing.Optional[CaptureWriter] = None
+    transport: typing.Optional[asyncio.Transport] = None
+    # прибавляется к каналам входящих событий, у адаптеров за Router - адрес первого канала адаптера
+    channel_offset = 0
 
     def __init__(
             self,
-            tty_name: str,
             loop: typing.Optional[asyncio.AbstractEventLoop],
+            max_inflight: int = MAX_INFLIGHT,
+            event_buffer_size: int = EVENT_BUFFER_SIZE,
+            event_drop_policy: str = DROP_OLDEST,
+            sensor_filter: typing.Optional[SensorFilter] = None,
     ):
-        self.callbacks: Dict[int, Callable] = {}
-        self.global_cbs = []
-        self._cmd_log: typing.Dict[int, datetime] = {}
-        self.event_que: asyncio.Queue[BaseNooliteRemote] = asyncio.Queue()
-        self.tty = _get_tty(tty_name)
-        self.loop = loop
-        self.loop.add_reader(self.tty.fd, self._handle_tty)
-        self.wait_ftr: typing.Optional[asyncio.Future] = None
-        self.wait_cmd: typing.Optional[NooliteCommand] = None
-        self.send_lck = asyncio.Lock()
-
-    def _handle_tty(self):
-        """
-        Хендлер входящих данных от адаптера
-        :return:
         """
-        while self.tty.in_waiting >= 17:
-            in_bytes = self.tty.read(17)
-            resp = NooliteCommand(*(x for x in in_bytes))
-            lg.debug(f'< %s', list(in_bytes))
-            if self._cancel_waiting(resp):
-                return
-            asyncio.create_task(self.handle_command(resp))
-
-    def _cancel_waiting(self, msg: NooliteCommand):
-        """
-        Отменяет ожидание подвтерждения, возвращает истину если ожидание было, ложь, если нет
-        :return:
+        :param loop: eventloop
+        :param max_inflight: максимальное кол-во одновременно отправляемых команд (на разные каналы)
+        :param event_buffer_size: размер буфера входящих событий, переживает переподключения к брокеру
+        :param event_drop_policy: что отбрасывать при переполнении буфера, DROP_OLDEST или DROP_NEWEST
+        :param sensor_filter: прореживание показаний датчиков температуры/влажности, по умолчанию в буфер событий
+            попадают все показания
         """
-        if isinstance(self.wait_ftr, asyncio.Future) \
-                and msg.ch == self.wait_cmd.ch \
-                and msg.mode == self.wait_cmd.mode:
-            self.wait_ftr.set_result(True)
-            lg.debug(f'{"Approved:".rjust(20, " ")} {self.wait_cmd}')
-            return True
-        else:
-            return False
+        self.max_inflight = max_inflight
+        self.sensor_filter = sensor_filter
+        self.event_que: EventBuffer = EventBuffer(event_buffer_size, event_drop_policy)
+        self.loop = loop
+        # очередь команд на каждый канал, сохраняет порядок отправки внутри канала
+        self._ch_locks: Dict[int, asyncio.Lock] = {}
+        self._scheduler = PriorityScheduler(max_inflight)
+        # сервисные операции идут отдельной полосой и не занимают слоты обычных команд
+        self._service = PriorityScheduler(1)
+        self.frames_out = 0
+        self._pending = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self.not_approved: typing.Counter[int] = Counter()
+        self.ack_latency = Histogram()
 
     @property
     async def in_commands(self):
@@ -70,7 +83,7 @@ class Noolite:
         while True:
             yield await self.event_que.get()
 
-    async def handle_command(self, resp: NooliteCommand):
+    def handle_command(self, resp: NooliteCommand):
         """
         При приеме входящего сообщения нужно вызвать этот метод
 
@@ -78,66 +91,303 @@ class Noolite:
         :return:
         """
         try:
+            if resp.cmd == const.SENS_TEMP_HUMI:
+                self.put_reading(TempHumReading.decode(resp))
+                return
             dispatcher, name = const.dispatchers.get(resp.cmd, (None, None))
             if name:
-                lg.debug(f'dispatching {name}')
+                lg.debug('dispatching %s', name)
             if dispatcher is None:
                 dispatcher = BaseNooliteRemote
-            remote = dispatcher(resp)
-            if isinstance(remote, MotionSensor):
-                l = self._cmd_log.get(remote.channel)
-                self._cmd_log[remote.channel] = datetime.now()
-                if l is not None:
-                    td = (datetime.now() - l).total_seconds()
-                    if td < const.MOTION_JITTER:
-                        lg.debug(f'anti-jitter: {resp}')
-                        return
-            await self.event_que.put(remote)
+            self.event_que.put_nowait(dispatcher(resp))
         except Exception:
-            lg.exception(f'handling {resp}')
-            raise
+            lg.exception('handling %s', resp)
+
+    def put_reading(self, reading: TempHumReading):
+        """
+        Показания датчика температуры/влажности - в буфер событий, если их пропустил sensor_filter
+        :param reading:
+        :return:
+        """
+        if self.sensor_filter is not None:
+            reading = self.sensor_filter.accept(reading)
+            if reading is None:
+                return
+        self.event_que.put_nowait(reading)
+
+    def _channel_lock(self, ch: int) -> asyncio.Lock:
+        lck = self._ch_locks.get(ch)
+        if lck is None:
+            lck = self._ch_locks[ch] = asyncio.Lock()
+        return lck
 
-    async def send_command(self, command: typing.Union[NooliteCommand, bytearray]):
+    async def send_command(
+            self,
+            command: typing.Union[NooliteCommand, bytes, bytearray],
+            priority: typing.Optional[int] = None,
+    ):
         """
-        Отправляет команды, асинхронно, ждет подтверждения уже отправленной команды
+        Отправляет команды, асинхронно, ждет подтверждения отправленной команды
+
+        Одновременно может ждать подтверждения не более max_inflight команд, причем на каждый канал - только одна,
+        следующая команда на тот же канал отправляется только после подтверждения (или таймаута) предыдущей. Так
+        неотвечающий канал не блокирует остальные. Свободный слот получает команда с более высоким приоритетом,
+        сервисные операции идут отдельной полосой
         :param command:
+        :param priority: см. scheduler.PRIORITY_*, по умолчанию PRIORITY_SERVICE для сервисных команд, для
+            остальных - PRIORITY_INTERACTIVE
+        :return: ответ адаптера (подтверждение) или True, если подтверждение не ждем
+        """
+        self._pending += 1
+        self._idle.clear()
+        try:
+            return await self._send(command, priority)
+        finally:
+            self._pending -= 1
+            if not self._pending:
+                self._idle.set()
+
+    async def wait_idle(self):
+        """
+        Ждет, пока не останется отправляемых команд
         :return:
         """
-        # отправляем только одну команду до получения подтверждения
-        async with self.send_lck:
-            if isinstance(command, NooliteCommand):
-                cmd = command.as_tuple()
-            else:
-                cmd = command
-            lg.debug(f'> {cmd}')
-            self.tty.write(bytearray(cmd))
-            # отправляем команду и ждем секунду, если придет ответ, то ожидание будет отменено с ошибкой CancelledError
-            # - значит от модуля пришел ответ о подтверждении команды, в противном случае поднимаем ошибку о том что
-            # команда не подтверждена
-
-            if command.commit is None:
-                return True
-            self.wait_ftr = self.loop.create_future()
-            self.wait_cmd = command
+        await self._idle.wait()
+
+    def queued(self) -> Dict[int, int]:
+        """
+        Кол-во команд, ожидающих слота отправки, по приоритетам
+        :return:
+        """
+        ret = self._scheduler.queued()
+        for priority, n in self._service.queued().items():
+            ret[priority] = ret.get(priority, 0) + n
+        return ret
+
+    def _lane(self, command: typing.Union[NooliteCommand, bytes, bytearray], priority: typing.Optional[int]):
+        """
+        Кадр, время ожидания подтверждения, приоритет и полоса отправки для команды
+        :return: (frame, commit, priority, scheduler)
+        """
+        if isinstance(command, NooliteCommand):
+            frame = command.frame
+            commit = command.commit
+            if priority is None:
+                priority = PRIORITY_SERVICE if command.is_service else PRIORITY_INTERACTIVE
+        else:
+            frame = command
+            commit = None
+            if priority is None:
+                priority = PRIORITY_INTERACTIVE
+        scheduler = self._service if priority == PRIORITY_SERVICE else self._scheduler
+        return frame, commit, priority, scheduler
+
+    @abc.abstractmethod
+    async def _send(self, command: typing.Union[NooliteCommand, bytes, bytearray], priority: typing.Optional[int]):
+        """
+        Отправляет кадр, когда до него дошла очередь
+        :return: подтверждение или True, если адаптер подтверждений не дает
+        """
+
+    @abc.abstractmethod
+    async def open(self):
+        pass
+
+    @abc.abstractmethod
+    def close(self):
+        pass
+
+
+class Noolite(NooliteBase, asyncio.Protocol):
+
+    def __init__(
+            self,
+            tty_name: str,
+            loop: typing.Optional[asyncio.AbstractEventLoop],
+            event_filter: typing.Optional[EventFilter] = None,
+            capture: typing.Optional[CaptureWriter] = None,
+            **kwargs,
+    ):
+        """
+        :param tty_name: имя порта или tcp://host:port - адаптер, подключенный к другой машине (см. gateway)
+        :param loop: eventloop
+        :param event_filter: антидребезг входящих событий, по умолчанию - только для датчиков движения
+        :param capture: если задан, все кадры в обе стороны записываются в файл
+        :param kwargs: max_inflight, event_buffer_size, event_drop_policy, sensor_filter - см. NooliteBase
+
+        Порт открывается в open(), команды, отправленные раньше, ждут открытия порта. Noolite - протокол
+        asyncio для SerialTransport: запись не блокирует eventloop, при переполнении буфера записи отправка ждет
+        его опустошения. При потере порта (например, адаптер вынули) порт переоткрывается
+        """
+        super().__init__(loop, **kwargs)
+        self.event_filter = event_filter if event_filter is not None else EventFilter()
+        self.callbacks: Dict[int, Callable] = {}
+        self.global_cbs = []
+        self.tty_name = tty_name
+        self.capture = capture
+        self.transport: typing.Optional[asyncio.Transport] = None
+        # получают все входящие кадры, кроме подтверждений
+        self.taps: typing.List[Callable[[bytes], None]] = []
+        self._ready = asyncio.Event()
+        self._can_write = asyncio.Event()
+        self._can_write.set()
+        self._closed = False
+        self.decoder = FrameDecoder()
+        # ожидающие подтверждения команды, ключ - (ch, mode)
+        self._waiting: Dict[Tuple[int, int], asyncio.Future] = {}
+        self._write_lck = asyncio.Lock()
+        self._last_write = 0.
+
+    async def open(self):
+        """
+        Открывает порт в отдельном потоке, чтобы не блокировать eventloop, или подключается к шлюзу
+        :return:
+        """
+        if self.tty_name.startswith('tcp://'):
+            url = urlsplit(self.tty_name)
+            await self.loop.create_connection(lambda: self, url.hostname, url.port)
+        else:
+            serial_port = await self.loop.run_in_executor(None, _get_tty, self.tty_name)
+            SerialTransport(self.loop, serial_port, self)
+        await self._ready.wait()
+        lg.info('%s opened', self.tty_name)
+
+    def close(self):
+        self._closed = True
+        if self.transport is not None:
+            self.transport.close()
+
+    def connection_made(self, transport: asyncio.Transport):
+        self.transport = transport
+        self._can_write.set()
+        self._ready.set()
+
+    def connection_lost(self, exc: typing.Optional[Exception]):
+        self.transport = None
+        self._ready.clear()
+        if not self._closed:
+            lg.error('%s lost: %r', self.tty_name, exc)
+            asyncio.ensure_future(self._reopen())
+
+    async def _reopen(self):
+        backoff = Backoff(REOPEN_TIME_MIN, REOPEN_TIME_MAX)
+        while not self._closed:
+            await asyncio.sleep(backoff.next())
             try:
-                await asyncio.wait_for(self.wait_ftr, command.commit)
-                await asyncio.sleep(0.05)
-            except asyncio.CancelledError:
-                return True
-            except asyncio.TimeoutError:
-                raise NotApprovedError(command)
-            finally:
-                self.wait_ftr = None
-                self.wait_cmd = None
-
-
-def _get_tty(tty_name) -> serial.Serial:
+                await self.open()
+                return
+            except Exception as exc:
+                lg.warning('reopening %s: %r', self.tty_name, exc)
+
+    def pause_writing(self):
+        self._can_write.clear()
+
+    def resume_writing(self):
+        self._can_write.set()
+
+    def data_received(self, data: bytes):
+        self.feed(data)
+
+    def feed(self, data: bytes):
+        """
+        Разбирает байты от адаптера: подтверждения завершают ожидание, события идут в буфер. Кроме порта вызывается
+        при воспроизведении записи (capture.replay)
+        :param data:
+        :return:
+        """
+        capture = self.capture
+        tapped = [] if self.taps else None
+        for in_bytes in self.decoder.feed(data):
+            resp = NooliteCommand.from_bytes(in_bytes)
+            lg.debug('< %s', in_bytes)
+            approved = self._cancel_waiting(resp)
+            if capture is not None:
+                capture.record(DIR_ACK if approved else DIR_IN, in_bytes)
+            if self.channel_offset:
+                resp.ch += self.channel_offset
+            # ответ на READ_STATE одновременно и подтверждение, и событие с состоянием устройства
+            if approved and resp.cmd != const.SEND_STATE:
+                continue
+            if tapped is not None:
+                tapped.append(in_bytes)
+            if not self.event_filter.accept(resp.ch, resp.cmd):
+                lg.debug('anti-jitter: %s', resp)
+                continue
+            self.handle_command(resp)
+        if tapped:
+            # один буфер на все кадры куска, всем подписчикам - один и тот же объект
+            chunk = tapped[0] if len(tapped) == 1 else b''.join(tapped)
+            for tap in self.taps:
+                tap(chunk)
+
+    def _cancel_waiting(self, msg: NooliteCommand):
+        """
+        Отменяет ожидание подвтерждения, возвращает истину если ожидание было, ложь, если нет
+        :return:
+        """
+        ftr = self._waiting.get((msg.ch, msg.mode))
+        if ftr is not None and not ftr.done():
+            ftr.set_result(msg)
+            lg.debug('%s %s', 'Approved:'.rjust(20, ' '), msg)
+            return True
+        else:
+            return False
+
+    async def _write(self, frame: typing.Union[bytes, bytearray]):
+        """
+        Пишет кадр в порт, выдерживая паузу FRAME_GAP между кадрами
+        :param frame:
+        :return:
+        """
+        async with self._write_lck:
+            delay = self._last_write + FRAME_GAP - self.loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            while self.transport is None:
+                await self._ready.wait()
+            self.transport.write(frame)
+            self._last_write = self.loop.time()
+            if self.capture is not None:
+                self.capture.record(DIR_OUT, frame)
+            self.frames_out += 1
+            # drain: если буфер записи выше high, ждем, пока он не опустеет ниже low
+            if not self._can_write.is_set():
+                await self._can_write.wait()
+
+    async def _send(self, command: typing.Union[NooliteCommand, bytes, bytearray], priority: typing.Optional[int]):
+        frame, commit, priority, scheduler = self._lane(command, priority)
+        ch, mode = frame[4], frame[1]
+        async with self._channel_lock(ch):
+            async with scheduler.slot(priority):
+                lg.debug('> %s', frame)
+                if commit is None:
+                    await self._write(frame)
+                    return True
+                # ожидание регистрируем до отправки, чтобы не пропустить быстрый ответ адаптера
+                key = (ch, mode)
+                ftr = self.loop.create_future()
+                self._waiting[key] = ftr
+                try:
+                    await self._write(frame)
+                    sent = self.loop.time()
+                    ret = await asyncio.wait_for(ftr, commit)
+                    self.ack_latency.observe(self.loop.time() - sent)
+                    return ret
+                except asyncio.TimeoutError:
+                    self.not_approved[ch] += 1
+                    raise NotApprovedError(command)
+                finally:
+                    self._waiting.pop(key, None)
+
+
+def _get_tty(tty_name) -> 'serial.Serial':
     """
     Подключение к последовательному порту
     :param tty_name: имя порта
     :return:
     """
-    serial_port = serial.Serial(tty_name, 9600, timeout=2)
+    import serial
+    serial_port = serial.Serial(tty_name, 9600, timeout=0)
     if not serial_port.is_open:
         serial_port.open()
     serial_port.flushInput()
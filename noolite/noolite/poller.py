@@ -0,0 +1,111 @@
+import asyncio
+import heapq
+import time
+import typing
+from typing import Dict, Optional
+
+from logger import root_logger
+from . import const
+from .noolite import Noolite, NotApprovedError
+from .scheduler import PRIORITY_POLL
+from .typing import NooliteCommand, StateReading
+
+lg = root_logger.getChild('noolite')
+
+MODE_TX_F = 2
+
+
+class Poller:
+    """
+    Фоновый опрос состояния устройств nooLite-F командой READ_STATE
+
+    Опросы идут не чаще budget в минуту (ограничение на радиоэфир) и только когда адаптер не занят другими
+    командами. Интервал опроса канала адаптивный: если состояние изменилось с прошлого опроса - интервал
+    уменьшается вдвое, если нет - растет в 1.5 раза, в пределах от min_interval до max_interval. Ответ устройства
+    (SEND_STATE) сам попадает в поток входящих событий
+    """
+
+    def __init__(
+            self,
+            noolite: Noolite,
+            channels: typing.Iterable[int],
+            budget: float = 6,
+            min_interval: float = 30,
+            max_interval: float = 600,
+            timeout: float = 2,
+    ):
+        """
+        :param noolite:
+        :param channels: опрашиваемые каналы
+        :param budget: максимальное кол-во опросов в минуту
+        :param min_interval: минимальный интервал опроса канала, сек
+        :param max_interval: максимальный интервал опроса канала, сек
+        :param timeout: сколько ждать ответа устройства, сек
+        """
+        if budget <= 0:
+            raise ValueError(f'poll budget must be positive, got {budget}')
+        self.noolite = noolite
+        self.channels = list(channels)
+        self.spacing = 60. / budget
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.timeout = timeout
+        self.intervals: Dict[int, float] = {ch: min_interval for ch in self.channels}
+        self.readings: Dict[int, StateReading] = {}
+        self.polls = 0
+        self.failures = 0
+
+    async def poll(self, ch: int) -> Optional[StateReading]:
+        """
+        Запрашивает состояние канала
+        :param ch:
+        :return: состояние или None, если устройство не ответило
+        """
+        self.polls += 1
+        cmd = NooliteCommand(mode=MODE_TX_F, ch=ch, cmd=const.READ_STATE, commit=self.timeout)
+        try:
+            resp = await self.noolite.send_command(cmd, priority=PRIORITY_POLL)
+        except NotApprovedError:
+            self.failures += 1
+            return None
+        if resp.cmd != const.SEND_STATE:
+            return None
+        return StateReading.decode(resp)
+
+    def _next_interval(self, ch: int, reading: Optional[StateReading]) -> float:
+        interval = self.intervals[ch]
+        if reading is None:
+            interval = self.max_interval
+        else:
+            last = self.readings.get(ch)
+            self.readings[ch] = reading
+            if last is not None and (last.on, last.brightness) != (reading.on, reading.brightness):
+                interval /= 2
+            else:
+                interval *= 1.5
+        interval = min(self.max_interval, max(self.min_interval, interval))
+        self.intervals[ch] = interval
+        return interval
+
+    async def run(self):
+        now = time.monotonic()
+        # первый опрос всех каналов равномерно распределяем по бюджету
+        heap = [(now + i * self.spacing, ch) for i, ch in enumerate(self.channels)]
+        heapq.heapify(heap)
+        last = 0.
+        while heap:
+            due, ch = heap[0]
+            delay = max(due, last + self.spacing) - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            # команды от пользователя всегда важнее
+            await self.noolite.wait_idle()
+            heapq.heappop(heap)
+            last = time.monotonic()
+            try:
+                reading = await self.poll(ch)
+            except Exception:
+                lg.exception('polling %s', ch)
+                reading = None
+            lg.debug('poll %s: %s', ch, reading)
+            heapq.heappush(heap, (time.monotonic() + self._next_interval(ch, reading), ch))
@@ -0,0 +1,108 @@
+import asyncio
+import time
+import typing
+from typing import Callable, Awaitable, Dict, List, Optional, Tuple
+
+from logger import root_logger
+from .buffer import EventBuffer
+
+lg = root_logger.getChild('noolite')
+
+Message = Tuple[str, str]
+
+
+class BatchPublisher:
+    """
+    Публикует входящие события пачками
+
+    Забирает из буфера все накопившиеся события (не больше max_batch), повторы того же состояния в тот же топик в
+    пределах coalesce_window отбрасывает, остальные публикует параллельно, не больше max_inflight топиков
+    одновременно. Сообщения в один топик публикуются по порядку. Неопубликованные события возвращаются в буфер
+    """
+
+    def __init__(
+            self,
+            max_inflight: int = 8,
+            max_batch: int = 64,
+            coalesce_window: float = 0.5,
+            clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        :param max_inflight: сколько топиков публикуется одновременно
+        :param max_batch: максимальный размер пачки
+        :param coalesce_window: окно, в котором повтор того же состояния в тот же топик не публикуется, сек
+        :param clock: источник времени
+        """
+        self.max_inflight = max_inflight
+        self.max_batch = max_batch
+        self.coalesce_window = coalesce_window
+        self.clock = clock
+        self.coalesced = 0
+        self.batches = 0
+        self._last: Dict[str, Tuple[str, float]] = {}
+
+    def _is_repeat(self, topic: str, payload: str, now: float) -> bool:
+        last = self._last.get(topic)
+        return last is not None and last[0] == payload and now - last[1] < self.coalesce_window
+
+    async def run(
+            self,
+            que: EventBuffer,
+            publish: Callable[[str, str], Awaitable],
+            to_message: Callable[[typing.Any], Optional[Message]],
+    ):
+        """
+        Бесконечный цикл публикации
+        :param que: буфер входящих событий
+        :param publish: корутина публикации (topic, payload)
+        :param to_message: превращает событие в (topic, payload), None - событие не публикуется
+        :return:
+        """
+        sem = asyncio.Semaphore(self.max_inflight)
+        while True:
+            batch = [await que.get()]
+            while len(batch) < self.max_batch and not que.empty():
+                batch.append(que.get_nowait())
+            self.batches += 1
+            now = self.clock()
+            # события группируются по топику, чтобы сохранить порядок внутри топика
+            topics: Dict[str, List[Tuple[typing.Any, str]]] = {}
+            pending = []
+            for event in batch:
+                msg = to_message(event)
+                if msg is None:
+                    continue
+                topic, payload = msg
+                group = topics.get(topic)
+                last = group[-1][1] if group else None
+                if payload == last or (last is None and self._is_repeat(topic, payload, now)):
+                    self.coalesced += 1
+                    continue
+                if group is None:
+                    group = topics[topic] = []
+                group.append((event, payload))
+                pending.append(event)
+
+            published = set()
+
+            async def publish_topic(topic, group):
+                async with sem:
+                    for event, payload in group:
+                        await publish(topic, payload)
+                        self._last[topic] = (payload, self.clock())
+                        published.add(id(event))
+
+            try:
+                results = await asyncio.gather(
+                    *(publish_topic(topic, group) for topic, group in topics.items()),
+                    return_exceptions=True,
+                )
+                errors = [x for x in results if isinstance(x, BaseException)]
+                if errors:
+                    raise errors[0]
+            except BaseException:
+                # соединение с брокером потеряно - неопубликованные события вернутся в буфер в исходном порядке
+                for event in reversed(pending):
+                    if id(event) not in published:
+                        que.requeue(event)
+                raise
@@ -0,0 +1,297 @@
+import json
+import typing
+from typing import Dict, Optional
+
+from .router import address, CHANNELS, MAX_ADAPTERS
+
+
+class Light(typing.NamedTuple):
+    """
+    Светильник: топики и конфиг discovery, посчитанные один раз при старте. ch здесь и у остальных устройств - адрес
+    канала (см. router), у первого адаптера совпадает с каналом
+    """
+    ch: int
+    name: str
+    brightness: bool
+    unique_id: str
+    state_topic: str
+    command_topic: str
+    config_topic: str
+    config: str
+    poll: bool = False
+
+
+class Motion(typing.NamedTuple):
+    """
+    Датчик движения или пульт, для пультов с долгим нажатием (long) - еще и отдельный сенсор для долгих нажатий
+    """
+    ch: int
+    name: str
+    unique_id: str
+    state_topic: str
+    config_topic: str
+    config: str
+    long_topic: Optional[str] = None
+    long_config_topic: Optional[str] = None
+    long_config: Optional[str] = None
+    debounce: Optional[float] = None
+    long_debounce: Optional[float] = None
+
+
+class Group(typing.NamedTuple):
+    """
+    Группа каналов (адресов, могут быть на разных адаптерах), в Home Assistant - один светильник
+    """
+    id: str
+    name: str
+    channels: typing.Tuple[int, ...]
+    brightness: bool
+    unique_id: str
+    state_topic: str
+    command_topic: str
+    config_topic: str
+    config: str
+
+
+class Sensor(typing.NamedTuple):
+    """
+    Датчик температуры (PT112) или температуры и влажности (PT111), в Home Assistant - по сенсору на величину
+    """
+    ch: int
+    name: str
+    unique_id: str
+    state_topic: str
+    config_topic: str
+    config: str
+    # переопределенные в настройках поля SensorSettings
+    filter: Dict[str, float]
+    hum_config_topic: Optional[str] = None
+    hum_config: Optional[str] = None
+
+
+# настройки фильтра показаний датчика, см. filters.SensorSettings
+_SENSOR_FILTER_KEYS = ('temp_deadband', 'hum_deadband', 'min_interval', 'max_interval', 'window')
+# ключи настроек, которые нужны только аддону и не передаются в Home Assistant
+_PRIVATE_KEYS = ('ch', 'adapter', 'long', 'debounce', 'long_debounce', 'poll', 'id', 'channels', 'humidity') + \
+    _SENSOR_FILTER_KEYS
+
+
+class Registry:
+    """
+    Справочник устройств, собирается один раз из настроек аддона, сами настройки не изменяет
+    """
+
+    def __init__(self, cfg: dict, prefix: str, availability_topic: str):
+        """
+        :param cfg: настройки аддона (/data/options.json)
+        :param prefix: префикс топиков mqtt
+        :param availability_topic: топик доступности аддона
+        """
+        self.prefix = prefix
+        self.availability_topic = availability_topic
+        self.lights: Dict[int, Light] = {}
+        self.motions: Dict[int, Motion] = {}
+        for value in cfg.get('lights', ()):
+            light = self._make_light(value)
+            self.lights[light.ch] = light
+        for value in cfg.get('motion', ()):
+            motion = self._make_motion(value)
+            self.motions[motion.ch] = motion
+        self.groups: Dict[str, Group] = {}
+        for value in cfg.get('groups', ()):
+            group = self._make_group(value)
+            self.groups[group.id] = group
+        self.sensors: Dict[int, Sensor] = {}
+        for value in cfg.get('sensors', ()):
+            sensor = self._make_sensor(value)
+            self.sensors[sensor.ch] = sensor
+        self.group_by_topic: Dict[str, Group] = {x.command_topic: x for x in self.groups.values()}
+        self._channels: Dict[str, int] = {x.command_topic: x.ch for x in self.lights.values()}
+        self._topics: Dict[typing.Tuple[str, int], str] = {}
+
+    def _make_light(self, value: dict) -> Light:
+        ch = address(value.get('adapter', 0), value['ch'])
+        state_topic = f'{self.prefix}/s/{ch}'
+        command_topic = f'{state_topic}/set'
+        id = f'{self.prefix}_s_{ch}'
+        payload = {k: v for k, v in value.items() if k not in _PRIVATE_KEYS}
+        if value.get('brightness'):
+            payload['brightness_scale'] = 100
+        payload.update(
+            unique_id=id,
+            availability_topic=self.availability_topic,
+            command_topic=command_topic,
+            state_topic=state_topic,
+            schema='json',
+        )
+        return Light(
+            ch=ch,
+            name=value.get('name', ''),
+            brightness=bool(value.get('brightness')),
+            unique_id=id,
+            state_topic=state_topic,
+            command_topic=command_topic,
+            config_topic=f'homeassistant/light/{id}/config',
+            config=json.dumps(payload, sort_keys=True),
+            poll=bool(value.get('poll')),
+        )
+
+    def _make_group(self, value: dict) -> Group:
+        gid = value['id']
+        state_topic = f'{self.prefix}/g/{gid}'
+        command_topic = f'{state_topic}/set'
+        id = f'{self.prefix}_g_{gid}'
+        payload = {k: v for k, v in value.items() if k not in _PRIVATE_KEYS}
+        if value.get('brightness'):
+            payload['brightness_scale'] = 100
+        payload.update(
+            unique_id=id,
+            availability_topic=self.availability_topic,
+            command_topic=command_topic,
+            state_topic=state_topic,
+            schema='json',
+        )
+        return Group(
+            id=gid,
+            name=value.get('name', ''),
+            channels=tuple(value['channels']),
+            brightness=bool(value.get('brightness')),
+            unique_id=id,
+            state_topic=state_topic,
+            command_topic=command_topic,
+            config_topic=f'homeassistant/light/{id}/config',
+            config=json.dumps(payload, sort_keys=True),
+        )
+
+    def _make_motion(self, value: dict) -> Motion:
+        ch = address(value.get('adapter', 0), value['ch'])
+        state_topic = f'{self.prefix}/m/{ch}'
+        id = f'{self.prefix}_m_{ch}'
+        payload = {k: v for k, v in value.items() if k not in _PRIVATE_KEYS}
+        payload.setdefault('off_delay', 1)
+        long = {}
+        if value.get('long'):
+            lid = f'{id}_l'
+            long_payload = payload.copy()
+            if 'name' in long_payload:
+                long_payload['name'] = long_payload['name'] + ' L'
+            long_payload.update(
+                unique_id=lid,
+                availability_topic=self.availability_topic,
+                state_topic=f'{state_topic}_l',
+            )
+            long = dict(
+                long_topic=f'{state_topic}_l',
+                long_config_topic=f'homeassistant/binary_sensor/{lid}/config',
+                long_config=json.dumps(long_payload, sort_keys=True),
+            )
+        payload.update(
+            unique_id=id,
+            availability_topic=self.availability_topic,
+            state_topic=state_topic,
+        )
+        return Motion(
+            ch=ch,
+            name=value.get('name', ''),
+            unique_id=id,
+            state_topic=state_topic,
+            config_topic=f'homeassistant/binary_sensor/{id}/config',
+            config=json.dumps(payload, sort_keys=True),
+            debounce=value.get('debounce'),
+            long_debounce=value.get('long_debounce'),
+            **long,
+        )
+
+    def _make_sensor(self, value: dict) -> Sensor:
+        ch = address(value.get('adapter', 0), value['ch'])
+        state_topic = f'{self.prefix}/t/{ch}'
+        id = f'{self.prefix}_t_{ch}'
+        payload = {k: v for k, v in value.items() if k not in _PRIVATE_KEYS}
+        payload.update(
+            availability_topic=self.availability_topic,
+            state_topic=state_topic,
+            state_class='measurement',
+        )
+        hum = {}
+        if value.get('humidity'):
+            hid = f'{id}_h'
+            hum_payload = payload.copy()
+            if 'name' in hum_payload:
+                hum_payload['name'] = hum_payload['name'] + ' H'
+            hum_payload.update(
+                unique_id=hid,
+                device_class='humidity',
+                unit_of_measurement='%',
+                value_template='{{ value_json.hum }}',
+            )
+            hum = dict(
+                hum_config_topic=f'homeassistant/sensor/{hid}/config',
+                hum_config=json.dumps(hum_payload, sort_keys=True),
+            )
+        payload.update(
+            unique_id=id,
+            device_class='temperature',
+            unit_of_measurement='°C',
+            value_template='{{ value_json.temp }}',
+        )
+        return Sensor(
+            ch=ch,
+            name=value.get('name', ''),
+            unique_id=id,
+            state_topic=state_topic,
+            config_topic=f'homeassistant/sensor/{id}/config',
+            config=json.dumps(payload, sort_keys=True),
+            filter={k: value[k] for k in _SENSOR_FILTER_KEYS if value.get(k) is not None},
+            **hum,
+        )
+
+    def discovery(self) -> Dict[str, str]:
+        """
+        Конфиги discovery для всех устройств: топик -> payload
+        :return:
+        """
+        ret = {x.config_topic: x.config for x in self.lights.values()}
+        for x in self.groups.values():
+            ret[x.config_topic] = x.config
+        for x in self.motions.values():
+            if x.long_config_topic:
+                ret[x.long_config_topic] = x.long_config
+            ret[x.config_topic] = x.config
+        for x in self.sensors.values():
+            if x.hum_config_topic:
+                ret[x.hum_config_topic] = x.hum_config
+            ret[x.config_topic] = x.config
+        return ret
+
+    def channel(self, topic: str) -> int:
+        """
+        Канал из топика вида <prefix>/<kind>/<ch>/<action>
+        :param topic:
+        :return:
+        :raises ValueError: в топике не номер канала или такого адреса нет, такие топики не кэшируются
+        """
+        ch = self._channels.get(topic)
+        if ch is None:
+            ch = int(topic.split('/')[-2])
+            if not 0 <= ch < CHANNELS * MAX_ADAPTERS:
+                raise ValueError(f'no channel {ch}')
+            self._channels[topic] = ch
+        return ch
+
+    def topic(self, kind: str, ch: int) -> str:
+        """
+        Топик <prefix>/<kind>/<ch>, строка собирается один раз на канал
+        :param kind: s - свет, m - датчики, m_l - долгие нажатия, r - сырые команды, b - готовые кадры,
+            t - датчики температуры/влажности
+        :param ch:
+        :return:
+        """
+        key = (kind, ch)
+        ret = self._topics.get(key)
+        if ret is None:
+            if kind == 'm_l':
+                ret = f'{self.prefix}/m/{ch}_l'
+            else:
+                ret = f'{self.prefix}/{kind}/{ch}'
+            self._topics[key] = ret
+        return ret
@@ -0,0 +1,145 @@
+"""
+Несколько адаптеров как один
+
+Адрес канала - номер адаптера * CHANNELS + канал адаптера, у первого адаптера адрес совпадает с каналом. Адрес
+помещается в байт канала кадра, так что команды для любого адаптера собираются как обычно, а Router по адресу
+выбирает адаптер и подставляет в кадр его канал. Входящие события адаптеры сразу пишут с адресом в общий буфер
+событий. У каждого адаптера своя очередь отправки, адаптеры друг друга не ждут
+"""
+import asyncio
+import typing
+from collections import Counter
+from typing import Dict, List, Tuple
+
+from .filters import EventFilter
+from .noolite import NooliteBase, Noolite
+from .typing import NooliteCommand
+
+CHANNELS = 64  # каналов у одного адаптера
+MAX_ADAPTERS = 256 // CHANNELS  # адрес должен поместиться в байт канала
+
+
+def address(adapter: int, ch: int) -> int:
+    """
+    Адрес канала ch адаптера adapter
+    :param adapter: номер адаптера
+    :param ch: канал адаптера
+    :return:
+    """
+    if not 0 <= adapter < MAX_ADAPTERS or not 0 <= ch < CHANNELS:
+        raise ValueError(f'no channel {ch} on adapter {adapter}')
+    return adapter * CHANNELS + ch
+
+
+def split(addr: int) -> Tuple[int, int]:
+    """
+    Номер адаптера и канал адаптера по адресу
+    :param addr:
+    :return:
+    """
+    return divmod(addr, CHANNELS)
+
+
+def _localize(command: typing.Union[NooliteCommand, bytes, bytearray], ch: int):
+    # копия: исходный кадр может быть закэширован (NooliteCommand.cached, main.light_commands)
+    if isinstance(command, NooliteCommand):
+        ret = NooliteCommand.from_bytes(command.frame, command.commit)
+        ret.ch = ch
+        return ret
+    ret = bytearray(command)
+    ret[4] = ch
+    ret[15] = sum(ret[:15]) & 0xFF
+    return ret
+
+
+class Router:
+    """
+    Интерфейс адаптера (send_command, in_commands, open, close ...) поверх нескольких адаптеров
+    """
+
+    def __init__(self, adapters: typing.Sequence[NooliteBase], event_filter: typing.Optional[EventFilter] = None):
+        """
+        :param adapters: адаптеры, номер адаптера - индекс в списке. Буфер событий, фильтр датчиков и гистограмма
+            подтверждений первого адаптера становятся общими
+        :param event_filter: общий антидребезг адаптеров MTRF-64 (у PR1132 входящих команд нет), ключ - адрес
+            канала. По умолчанию - только для датчиков движения
+        """
+        if not 1 <= len(adapters) <= MAX_ADAPTERS:
+            raise ValueError(f'1 to {MAX_ADAPTERS} adapters supported, got {len(adapters)}')
+        self.adapters: List[NooliteBase] = list(adapters)
+        first = self.adapters[0]
+        self.event_que = first.event_que
+        self.event_filter = event_filter if event_filter is not None else EventFilter()
+        self.sensor_filter = first.sensor_filter
+        self.ack_latency = first.ack_latency
+        for n, adapter in enumerate(self.adapters):
+            adapter.channel_offset = n * CHANNELS
+            adapter.event_que = self.event_que
+            if isinstance(adapter, Noolite):
+                adapter.event_filter = self.event_filter
+            adapter.sensor_filter = self.sensor_filter
+            adapter.ack_latency = self.ack_latency
+
+    def __len__(self):
+        return len(self.adapters)
+
+    @property
+    async def in_commands(self):
+        """
+        События всех адаптеров, каналы - адреса
+        :return:
+        """
+        while True:
+            yield await self.event_que.get()
+
+    async def open(self):
+        await asyncio.gather(*(x.open() for x in self.adapters))
+
+    def close(self):
+        for adapter in self.adapters:
+            adapter.close()
+
+    async def send_command(
+            self,
+            command: typing.Union[NooliteCommand, bytes, bytearray],
+            priority: typing.Optional[int] = None,
+    ):
+        """
+        Отправляет команду адаптеру, которому принадлежит адрес в поле канала кадра, см. NooliteBase.send_command
+        :param command: кадр, в поле канала - адрес
+        :param priority:
+        :return: подтверждение, канал в нем - адрес
+        """
+        frame = command.frame if isinstance(command, NooliteCommand) else command
+        n, ch = split(frame[4])
+        if n >= len(self.adapters):
+            raise ValueError(f'channel {frame[4]}: no adapter {n}')
+        if n:
+            command = _localize(command, ch)
+        return await self.adapters[n].send_command(command, priority)
+
+    async def wait_idle(self):
+        await asyncio.gather(*(x.wait_idle() for x in self.adapters))
+
+    def queued(self) -> Dict[int, int]:
+        ret = {}
+        for adapter in self.adapters:
+            for priority, n in adapter.queued().items():
+                ret[priority] = ret.get(priority, 0) + n
+        return ret
+
+    @property
+    def frames_out(self) -> int:
+        return sum(x.frames_out for x in self.adapters)
+
+    @property
+    def not_approved(self) -> typing.Counter[int]:
+        """
+        Неподтвержденные команды по адресам
+        :return:
+        """
+        ret = Counter()
+        for adapter in self.adapters:
+            for ch, n in adapter.not_approved.items():
+                ret[ch + adapter.channel_offset] += n
+        return ret
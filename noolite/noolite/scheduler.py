@@ -0,0 +1,86 @@
+import asyncio
+import itertools
+import time
+import typing
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, List
+
+PRIORITY_INTERACTIVE = 0  # команды из Home Assistant и mqtt
+PRIORITY_POLL = 2  # опрос состояния, догоняет команды из Home Assistant через 2 * AGING ожидания
+PRIORITY_SERVICE = 3  # привязка/отвязка и прочие долгие сервисные операции, идут отдельной полосой
+
+AGING = 5.  # за сколько секунд ожидания команда поднимается на один класс приоритета
+
+
+class PriorityScheduler:
+    """
+    Раздает ограниченное кол-во слотов отправки с учетом приоритета
+
+    Уже отправленные команды не вытесняются. Освободившийся слот получает ожидающая команда с наименьшим
+    эффективным приоритетом: приоритет минус время ожидания / aging, так что низкоприоритетные команды не
+    голодают бесконечно. При равенстве - в порядке поступления
+    """
+
+    def __init__(self, slots: int, aging: float = AGING, clock: Callable[[], float] = time.monotonic):
+        """
+        :param slots: кол-во одновременно занятых слотов
+        :param aging: секунд ожидания на один класс приоритета
+        :param clock: источник времени
+        """
+        self.slots = slots
+        self.aging = aging
+        self.clock = clock
+        self.busy = 0
+        self._waiters: List[typing.Tuple[int, float, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+
+    def _rank(self, entry, now: float):
+        priority, enqueued, seq, _ = entry
+        return priority - (now - enqueued) / self.aging, seq
+
+    async def acquire(self, priority: int):
+        if self.busy < self.slots and not self._waiters:
+            self.busy += 1
+            return
+        ftr = asyncio.get_event_loop().create_future()
+        entry = (priority, self.clock(), next(self._seq), ftr)
+        self._waiters.append(entry)
+        try:
+            await ftr
+        except asyncio.CancelledError:
+            if ftr.done() and not ftr.cancelled():
+                # слот уже был передан, отдаем его следующему
+                self.release()
+            else:
+                self._waiters.remove(entry)
+            raise
+
+    def release(self):
+        now = self.clock()
+        while self._waiters:
+            entry = min(self._waiters, key=lambda x: self._rank(x, now))
+            self._waiters.remove(entry)
+            ftr = entry[3]
+            if not ftr.done():
+                # слот переходит ожидающему, busy не меняется
+                ftr.set_result(None)
+                return
+        self.busy -= 1
+
+    @asynccontextmanager
+    async def slot(self, priority: int):
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def queued(self) -> Dict[int, int]:
+        """
+        Кол-во ожидающих слота команд по приоритетам
+        :return:
+        """
+        ret = {}
+        for priority, *_ in self._waiters:
+            ret[priority] = ret.get(priority, 0) + 1
+        return ret
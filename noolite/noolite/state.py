@@ -0,0 +1,125 @@
+import asyncio
+import json
+import os
+import time
+import typing
+from typing import Dict, Optional
+
+from logger import root_logger
+from .typing import br_to_raw
+
+lg = root_logger.getChild('noolite')
+
+SAVE_DELAY = 5  # через сколько секунд после изменения состояние сохраняется на диск
+
+
+class LightState(typing.NamedTuple):
+    """
+    Последнее подтвержденное состояние светильника
+    """
+    state: str  # ON / OFF
+    brightness: Optional[int] = None
+    updated: float = 0.  # time.time() подтверждения
+
+    def payload(self) -> str:
+        """
+        Состояние в формате json-схемы света Home Assistant
+        :return:
+        """
+        ret = {'state': self.state}
+        if self.brightness is not None:
+            ret['brightness'] = self.brightness
+        return json.dumps(ret)
+
+
+class StateCache:
+    """
+    Кэш состояний светильников по каналам, сохраняется в файл
+
+    Состояние считается актуальным ttl секунд после подтверждения: nooLite-устройства без обратной связи могут
+    быть переключены вручную, поэтому старому состоянию верить нельзя
+    """
+
+    def __init__(self, path: str, ttl: float = 60.):
+        """
+        :param path: файл для сохранения
+        :param ttl: сколько секунд состояние считается актуальным
+        """
+        self.path = path
+        self.ttl = ttl
+        self.states: Dict[int, LightState] = {}
+        self.skipped = 0
+        self._save_handle: Optional[asyncio.TimerHandle] = None
+        try:
+            with open(path) as f:
+                self.states = {int(ch): LightState(**value) for ch, value in json.load(f).items()}
+        except FileNotFoundError:
+            pass
+        except Exception:
+            lg.exception('loading %s', path)
+
+    def get(self, ch: int) -> Optional[LightState]:
+        return self.states.get(ch)
+
+    def is_current(self, ch: int, state: str, brightness: Optional[int] = None) -> bool:
+        """
+        Истина, если канал заведомо уже в этом состоянии и команду можно не отправлять
+        :param ch:
+        :param state:
+        :param brightness:
+        :return:
+        """
+        cur = self.states.get(ch)
+        if cur is None or time.time() - cur.updated > self.ttl:
+            return False
+        if cur.state != state:
+            return False
+        # для выключенного света яркость не важна. Яркость сравнивается по уровню в кадре: прочитанная опросом
+        # может отличаться от заданной в пределах шага уровня
+        if state == 'OFF' or brightness is None:
+            return True
+        return cur.brightness is not None and br_to_raw(brightness) == br_to_raw(cur.brightness)
+
+    def update(self, ch: int, state: str, brightness: Optional[int] = None):
+        """
+        Запоминает подтвержденное состояние
+        :param ch:
+        :param state:
+        :param brightness: None - прежняя яркость, в том числе при выключении: следующее ON без яркости включает
+            свет с ней же
+        :return:
+        """
+        if brightness is None:
+            cur = self.states.get(ch)
+            brightness = cur.brightness if cur is not None else None
+        self.states[ch] = LightState(state, brightness, time.time())
+        self._schedule_save()
+
+    def invalidate(self, ch: int):
+        """
+        Состояние канала неизвестно (например, после сырой команды)
+        :param ch:
+        :return:
+        """
+        if self.states.pop(ch, None) is not None:
+            self._schedule_save()
+
+    def _schedule_save(self):
+        if self._save_handle is None:
+            self._save_handle = asyncio.get_event_loop().call_later(SAVE_DELAY, self.save)
+
+    def save(self):
+        """
+        Сохраняет состояния сразу, отменяя отложенное сохранение. Вызывается и при завершении
+        :return:
+        """
+        if self._save_handle is not None:
+            self._save_handle.cancel()
+            self._save_handle = None
+        tmp = f'{self.path}.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                json.dump({ch: state._asdict() for ch, state in self.states.items()}, f)
+            os.replace(tmp, self.path)
+        except Exception:
+            lg.exception('saving %s', self.path)
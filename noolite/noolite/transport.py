@@ -0,0 +1,165 @@
+import asyncio
+import os
+import typing
+
+from logger import root_logger
+
+lg = root_logger.getChild('noolite')
+
+HIGH_WATER = 16 * 17  # при таком заполнении буфера записи протокол получает pause_writing
+MAX_READ = 4096
+
+
+class SerialTransport(asyncio.Transport):
+    """
+    Транспорт asyncio поверх открытого pyserial-порта
+
+    pyserial используется только для настройки порта, чтение и запись идут напрямую в неблокирующий
+    дескриптор: чтение по add_reader, запись - сразу, а что не влезло в буфер ядра - из собственного буфера по
+    add_writer. При заполнении буфера выше high протокол получает pause_writing, при опустошении ниже low -
+    resume_writing
+    """
+
+    def __init__(
+            self,
+            loop: asyncio.AbstractEventLoop,
+            serial_port,
+            protocol: asyncio.Protocol,
+            high: typing.Optional[int] = None,
+            low: typing.Optional[int] = None,
+    ):
+        super().__init__(extra={'serial': serial_port})
+        self._loop = loop
+        self._serial = serial_port
+        self._protocol = protocol
+        self._fd = serial_port.fileno()
+        self._buf = bytearray()
+        self._closing = False
+        self._conn_lost = False
+        self._paused = False
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.set_write_buffer_limits(high, low)
+        os.set_blocking(self._fd, False)
+        loop.add_reader(self._fd, self._read_ready)
+        loop.call_soon(protocol.connection_made, self)
+
+    def _read_ready(self):
+        try:
+            data = os.read(self._fd, MAX_READ)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as exc:
+            self._fatal(exc)
+            return
+        if not data:
+            self._fatal(ConnectionError('serial port closed'))
+            return
+        self.bytes_read += len(data)
+        self._protocol.data_received(data)
+
+    def write(self, data: typing.Union[bytes, bytearray, memoryview]):
+        if self._closing:
+            raise ConnectionError('transport is closing')
+        if not data:
+            return
+        if not self._buf:
+            # буфер пуст - пробуем записать сразу, без ожидания готовности дескриптора
+            try:
+                n = os.write(self._fd, data)
+            except (BlockingIOError, InterruptedError):
+                n = 0
+            except OSError as exc:
+                self._fatal(exc)
+                return
+            self.bytes_written += n
+            if n == len(data):
+                return
+            data = memoryview(data)[n:]
+            self._loop.add_writer(self._fd, self._write_ready)
+        self._buf += data
+        self._maybe_pause()
+
+    def _write_ready(self):
+        try:
+            n = os.write(self._fd, self._buf)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as exc:
+            self._fatal(exc)
+            return
+        self.bytes_written += n
+        del self._buf[:n]
+        self._maybe_resume()
+        if not self._buf:
+            self._loop.remove_writer(self._fd)
+            if self._closing:
+                self._call_connection_lost(None)
+
+    def _maybe_pause(self):
+        if not self._paused and len(self._buf) > self._high:
+            self._paused = True
+            self._protocol.pause_writing()
+
+    def _maybe_resume(self):
+        if self._paused and len(self._buf) <= self._low:
+            self._paused = False
+            self._protocol.resume_writing()
+
+    def get_write_buffer_size(self) -> int:
+        return len(self._buf)
+
+    def get_write_buffer_limits(self) -> typing.Tuple[int, int]:
+        return self._low, self._high
+
+    def set_write_buffer_limits(self, high: typing.Optional[int] = None, low: typing.Optional[int] = None):
+        if high is None:
+            high = HIGH_WATER if low is None else 4 * low
+        if low is None:
+            low = high // 4
+        if not 0 <= low <= high:
+            raise ValueError(f'high ({high}) must be >= low ({low}) must be >= 0')
+        self._high = high
+        self._low = low
+        self._maybe_pause()
+
+    def is_closing(self) -> bool:
+        return self._closing
+
+    def close(self):
+        """
+        Закрывает транспорт после записи всего буфера
+        """
+        if self._closing:
+            return
+        self._closing = True
+        self._loop.remove_reader(self._fd)
+        if not self._buf:
+            self._loop.call_soon(self._call_connection_lost, None)
+
+    def abort(self):
+        self._force_close(None)
+
+    def _fatal(self, exc: Exception):
+        lg.debug('serial port error: %r', exc)
+        self._force_close(exc)
+
+    def _force_close(self, exc: typing.Optional[Exception]):
+        if self._conn_lost:
+            return
+        if self._buf:
+            self._buf.clear()
+            self._loop.remove_writer(self._fd)
+        if not self._closing:
+            self._closing = True
+            self._loop.remove_reader(self._fd)
+        self._loop.call_soon(self._call_connection_lost, exc)
+
+    def _call_connection_lost(self, exc: typing.Optional[Exception]):
+        if self._conn_lost:
+            return
+        self._conn_lost = True
+        try:
+            self._protocol.connection_lost(exc)
+        finally:
+            self._serial.close()
@@ -1,8 +1,9 @@
 from collections import defaultdict
-from dataclasses import dataclass, astuple, field, asdict
+from dataclasses import dataclass
+from functools import lru_cache
 import time
+import typing
 from logger import root_logger
-import pydantic
 
 from noolite import const
 
@@ -15,57 +16,89 @@ _toggles = defaultdict(lambda : 0)
 lg = root_logger.getChild('noolite')
 
 
-class MqttCommand(pydantic.BaseModel):
+FIELDS = ('st', 'mode', 'ctr', 'togl', 'ch', 'cmd', 'fmt', 'd0', 'd1', 'd2', 'd3', 'id0', 'id1', 'id2', 'id3', 'crc', 'sp')
+CRC_POS = 15
+# уровни яркости в кадре (d0 у SET_BRIGHTNESS, d3 у SEND_STATE) для 0% и 100%
+BR_RAW_MIN = 40
+BR_RAW_MAX = 100
+
+
+def br_to_raw(br: float) -> int:
     """
-    Контейнер для безопасного переноса команды из json
+    Яркость Home Assistant в уровень яркости кадра
+    :param br: 0-100, значения вне диапазона ограничиваются
+    :return:
     """
-    mode: int = 0
-    ctr: int = 0
-    togl: int = 0
-    ch: int = 0
-    cmd: int = 0
-    fmt: int = 0
-    d0: int = 0
-    d1: int = 0
-    d2: int = 0
-    d3: int = 0
-    id0: int = 0
-    id1: int = 0
-    id2: int = 0
-    id3: int = 0
-    commit: bool = APPROVAL_TIMEOUT
-    nrep: int = 0
-    br: int = 0
-    duration: int = 0
+    br = min(max(br, 0), 100)
+    return BR_RAW_MIN + round(br / 100 * (BR_RAW_MAX - BR_RAW_MIN))
+
+
+def raw_to_br(raw: int) -> int:
+    """
+    Уровень яркости кадра в яркость Home Assistant, обратное к br_to_raw: br_to_raw(raw_to_br(raw)) == raw
+    :param raw: уровень, ниже BR_RAW_MIN - 0%, выше BR_RAW_MAX - 100%
+    :return: 0-100
+    """
+    br = round((raw - BR_RAW_MIN) * 100 / (BR_RAW_MAX - BR_RAW_MIN))
+    return min(max(br, 0), 100)
 
 
-@dataclass()
 class NooliteCommand:
     """
     Контейнер для команды от адаптера или к адаптеру
+
+    Хранит кадр в виде готового 17-байтового буфера, поля - свойства поверх этого буфера. При изменении поля
+    контрольная сумма пересчитывается инкрементально, так что кадр всегда готов к отправке без лишних копий
     """
-    st: int = 171
-    mode: int = 0
-    ctr: int = 0
-    togl: int = field(hash=False, compare=False, default=0)
-    ch: int = 0
-    cmd: int = 0
-    fmt: int = 0
-    d0: int = 0
-    d1: int = 0
-    d2: int = 0
-    d3: int = 0
-    id0: int = 0
-    id1: int = 0
-    id2: int = 0
-    id3: int = 0
-    crc: int = field(hash=False, default=0, compare=False)
-    sp: int = 172
-    commit: bool = APPROVAL_TIMEOUT
-
-    def __post_init__(self):
-        tup = list(astuple(self))
-        self.crc = NooliteCommand._calc_crc(tup)
+    __slots__ = ('_frame', 'commit')
+
+    def __init__(
+            self,
+            st: int = 171,
+            mode: int = 0,
+            ctr: int = 0,
+            togl: int = 0,
+            ch: int = 0,
+            cmd: int = 0,
+            fmt: int = 0,
+            d0: int = 0,
+            d1: int = 0,
+            d2: int = 0,
+            d3: int = 0,
+            id0: int = 0,
+            id1: int = 0,
+            id2: int = 0,
+            id3: int = 0,
+            crc: int = 0,
+            sp: int = 172,
+            commit: bool = APPROVAL_TIMEOUT,
+    ):
+        frame = bytearray((st, mode, ctr, togl, ch, cmd, fmt, d0, d1, d2, d3, id0, id1, id2, id3, 0, sp))
+        frame[CRC_POS] = (sum(frame) - sp) & 0xFF
+        self._frame = frame
+        self.commit = commit
+
+    @classmethod
+    def from_bytes(cls, data, commit=APPROVAL_TIMEOUT):
+        """
+        Создает команду из сырого кадра (17 байт)
+        :param data:
+        :param commit:
+        :return:
+        """
+        ret = cls.__new__(cls)
+        frame = ret._frame = bytearray(data)
+        frame[CRC_POS] = sum(frame[:CRC_POS]) & 0xFF
+        ret.commit = commit
+        return ret
+
+    @property
+    def frame(self) -> bytearray:
+        """
+        Готовый к отправке кадр, без копирования
+        :return:
+        """
+        return self._frame
 
     @staticmethod
     def _calc_crc(tup):
@@ -77,15 +110,49 @@ class NooliteCommand:
         Возвращает байты в нужной последовательности
         :return:
         """
-        tup = list(astuple(self))[:17]
-        return tup
+        return list(self._frame)
+
+    def __eq__(self, other):
+        if not isinstance(other, NooliteCommand):
+            return NotImplemented
+        # togl и crc не участвуют в сравнении
+        a, b = self._frame, other._frame
+        return a[:3] == b[:3] and a[4:15] == b[4:15] and a[16] == b[16] and self.commit == other.commit
+
+    __hash__ = None
+
+    def __repr__(self):
+        fields = ', '.join(f'{name}={value}' for name, value in zip(FIELDS, self._frame))
+        return f'NooliteCommand({fields}, commit={self.commit})'
+
+    @property
+    def is_service(self) -> bool:
+        """
+        Сервисная операция (привязка, отвязка, очистка памяти): может ждать ответа десятки секунд
+        :return:
+        """
+        if self._frame[5] in const.SERVICE_COMMANDS:
+            return True
+        # в режимах приема (1 - RX, 3 - RX-F) младшие биты ctr 3-7 - команды управления привязками адаптера
+        return self._frame[1] in (1, 3) and 3 <= self._frame[2] & 0x0F <= 7
 
     def make_send(self):
-        ret = asdict(self)
-        ret.update(st=171, sp=172, mode=0)
-        ret = NooliteCommand(**ret)
+        ret = NooliteCommand.from_bytes(self._frame, commit=self.commit)
+        ret.st = 171
+        ret.sp = 172
+        ret.mode = 0
         return ret
 
+    @classmethod
+    @lru_cache(maxsize=1024)
+    def cached(cls, **kwargs):
+        """
+        То же что make_command, но возвращает общий для одинаковых аргументов экземпляр, изменять его нельзя
+        :param kwargs:
+        :return:
+        """
+        return cls.make_command(**kwargs)
+
     @classmethod
     def make_command(
             cls,
@@ -105,7 +172,7 @@ class NooliteCommand:
         :param kwargs:
         :return:
         """
-        lg.debug(f'build command: {args}, nrep={nrep}, duration={duration}, {kwargs}')
+        lg.debug('build command: %s, nrep=%s, duration=%s, %s', args, nrep, duration, kwargs)
         assert nrep <= 3
         if duration:
             # kwargs['cmd'] = const.TEMPORARY_ON
@@ -114,17 +181,46 @@ class NooliteCommand:
             kwargs['d1'] = ((duration // 5) & 0xFF00) >> 8
         if br:
             kwargs['fmt'] = 1
-            kwargs['d0'] = 40 + round((br / 100) * 60)
+            kwargs['d0'] = br_to_raw(br)
         ret = cls(*args, **kwargs)
-        if nrep == 0:
-            return ret
-        lg.debug(f'{ret}')
-        ret = list(astuple(ret))
-        ret[14] = NooliteCommand._calc_crc(ret)
-        ctr = ret[2]
-        ctr = int(f'{nrep:02b}' + f'{ctr:05b}', 2)
-        ret[2] = ctr
-        return cls(*ret)
+        if nrep:
+            ret.ctr = (nrep << 5) | ret.ctr
+        return ret
+
+
+def _byte_field(idx):
+    def fget(self):
+        return self._frame[idx]
+
+    def fset(self, value):
+        frame = self._frame
+        old = frame[idx]
+        frame[idx] = value
+        if idx < CRC_POS:
+            frame[CRC_POS] = (frame[CRC_POS] + value - old) & 0xFF
+    return property(fget, fset)
+
+
+for _idx, _name in enumerate(FIELDS):
+    setattr(NooliteCommand, _name, _byte_field(_idx))
+
+
+def warm_cache(channels, duration, levels: typing.Optional[typing.Dict[int, typing.Iterable[int]]] = None):
+    """
+    Заранее собирает кадры, которые запрашивает main.light_commands: OFF и TEMPORARY_ON для указанных каналов и
+    SET_BRIGHTNESS для заданных уровней. Все 100 уровней на каждый канал в кэш не помещаются
+    :param channels:
+    :param duration: время для TEMPORARY_ON
+    :param levels: канал -> яркости, для которых собрать SET_BRIGHTNESS
+    :return:
+    """
+    # аргументы и их порядок такие же как в main.light_commands, иначе ключ кэша не совпадет
+    for ch in channels:
+        NooliteCommand.cached(ch=ch, duration=None, cmd=const.OFF)
+        NooliteCommand.cached(ch=ch, duration=duration, cmd=const.TEMPORARY_ON)
+    for ch, brs in (levels or {}).items():
+        for br in brs:
+            NooliteCommand.cached(ch=ch, br=br, cmd=const.SET_BRIGHTNESS)
 
 
 @dataclass()
@@ -164,14 +260,94 @@ class BaseNooliteRemote(object):
 
     @property
     def battery_status(self):
-        return int('{:08b}'.format(self.command.d1)[0])
+        return battery_status(self.command.d1)
+
+
+def battery_status(d1: int) -> int:
+    """
+    Статус элемента питания: старший бит D1
+    :param d1:
+    :return:
+    """
+    return d1 >> 7
+
+
+def sensor_type(d1: int) -> int:
+    """
+    Тип датчика: биты 6-4 D1, см. const.SENS_TEMP, const.SENS_HUM_TEMP
+    :param d1:
+    :return:
+    """
+    return (d1 >> 4) & 0x07
+
+
+def temperature(d0: int, d1: int) -> float:
+    """
+    Температура: 12 бит (младшие 4 бита D1 и D0), старший бит - знак
+    :param d0:
+    :param d1:
+    :return:
+    """
+    raw = ((d1 & 0x0F) << 8) | d0
+    # Если старший бит 1 - ниже нуля. В этом случае необходимо от 4096 отнять полученное значение
+    if raw & 0x800:
+        raw -= 4096
+    return raw / 10.
+
+
+class TempHumReading(typing.NamedTuple):
+    """
+    Разобранные показания датчика температуры/влажности
+    """
+    ch: int
+    sensor_type: int
+    temp: float
+    hum: typing.Optional[int]
+    battery: int
+    analog: int
+
+    @classmethod
+    def decode(cls, command: NooliteCommand):
+        ch, d0, d1, d2, d3 = command.ch, command.d0, command.d1, command.d2, command.d3
+        stype = sensor_type(d1)
+        return cls(
+            ch,
+            stype,
+            temperature(d0, d1),
+            # Если датчик PT111 (с влажностью), то получаем влажность из 3 байта данных
+            d2 if stype == const.SENS_HUM_TEMP else None,
+            battery_status(d1),
+            # Значение, считываемое с аналогового входа датчика; 8 бит; (по умолчанию = 255)
+            d3,
+        )
+
+
+class MotionReading(typing.NamedTuple):
+    """
+    Разобранная команда датчика движения
+    """
+    ch: int
+    active_time: int
+    battery: int
+
+    @classmethod
+    def decode(cls, command: NooliteCommand):
+        return cls(command.ch, command.d0 * 5, battery_status(command.d1))
 
 
 class TempHumSensor(BaseNooliteRemote):
 
+    def __init__(self, command: NooliteCommand):
+        super().__init__(command)
+        self.reading = TempHumReading.decode(command)
+
     def __str__(self):
         return 'Ch: {}, battery: {}, temp: {}, hum: {}'.format(self.channel, self.battery_status, self.temp, self.hum)
 
+    @property
+    def battery_status(self):
+        return self.reading.battery
+
     @property
     def sensor_type(self):
         """
@@ -182,7 +358,7 @@ class TempHumSensor(BaseNooliteRemote):
         #   000-зарезервировано
         #   001-датчик температуры (PT112)
         #   010-датчик температуры/влажности (PT111)
-        return '{:08b}'.format(self.command.d1)[1:4]
+        return self.reading.sensor_type
 
     @property
     def temp(self):
@@ -190,13 +366,7 @@ class TempHumSensor(BaseNooliteRemote):
         температура
         :return:
         """
-        temp_bits = '{:08b}'.format(self.command.d1)[4:] + '{:08b}'.format(self.command.d0)
-        # Если первый бит 0 - температура считается выше нуля
-        if temp_bits[0] == '0':
-            return int(temp_bits, 2) / 10.
-        # Если 1 - ниже нуля. В этом случае необходимо от 4096 отнять полученное значение
-        elif temp_bits[0] == '1':
-            return -((4096 - int(temp_bits, 2)) / 10.)
+        return self.reading.temp
 
     @property
     def hum(self):
@@ -204,28 +374,34 @@ class TempHumSensor(BaseNooliteRemote):
         влажность
         :return:
         """
-        # Если датчик PT111 (с влажностью), то получаем влажность из 3 байта данных
-        if self.sensor_type == '010':
-            return self.command.d2
+        return self.reading.hum
 
     @property
     def analog_sens(self):
         # Значение, считываемое с аналогового входа датчика; 8 бит; (по умолчанию = 255)
-        return self.command.d3
+        return self.reading.analog
 
 
 class MotionSensor(BaseNooliteRemote):
 
+    def __init__(self, command: NooliteCommand):
+        super().__init__(command)
+        self.reading = MotionReading.decode(command)
+
     def __str__(self):
         return 'Ch: {}, battery: {}, active_time: {}'.format(self.channel, self.battery_status, self.active_time)
 
+    @property
+    def battery_status(self):
+        return self.reading.battery
+
     @property
     def active_time(self):
         """
         Время на которое включается устройство
         :return:
         """
-        return self.command.d0 * 5
+        return self.reading.active_time
 
     @property
     def is_active(self):
@@ -235,3 +411,43 @@ class MotionSensor(BaseNooliteRemote):
         """
         return self.last_update + self.active_time >= time.time()
 
+
+class StateReading(typing.NamedTuple):
+    """
+    Ответ исполнительного устройства nooLite-F на READ_STATE (SEND_STATE, fmt=0)
+    """
+    ch: int
+    device_type: int
+    firmware: int
+    on: bool
+    brightness: int  # 0-100
+
+    @classmethod
+    def decode(cls, command: NooliteCommand):
+        # D2: биты 0-3 - состояние (0 - выключено, 1 - включено, 2 - временно включено)
+        # D3: уровень яркости, в той же шкале, что d0 у SET_BRIGHTNESS
+        return cls(
+            command.ch,
+            command.d0,
+            command.d1,
+            (command.d2 & 0x0F) in (1, 2),
+            raw_to_br(command.d3),
+        )
+
+
+class DeviceState(BaseNooliteRemote):
+
+    def __init__(self, command: NooliteCommand):
+        super().__init__(command)
+        self.reading = StateReading.decode(command)
+
+    def __str__(self):
+        return 'Ch: {}, on: {}, brightness: {}'.format(self.channel, self.on, self.brightness)
+
+    @property
+    def on(self):
+        return self.reading.on
+
+    @property
+    def brightness(self):
+        return self.reading.brightness